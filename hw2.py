@@ -1,11 +1,30 @@
-from typing import List, Tuple, Optional
-from random import choice
+from typing import Dict, List, Tuple, Optional
+from multiprocessing import Pool
+from random import Random, choice
+from time import perf_counter
 
 INVALID_POSITION = 0
 EMPTY_POSITION = 1
 ROUND_OVER = 2
 PLAY_AGAIN = 3
 
+# (position, seeds sown, seeds captured), see play_undoable
+Undo = Tuple[int, int, int]
+
+SIMULATION_CHUNK = 1000
+
+# transposition table entries: (key, depth, value, bound, best move)
+TableEntry = Tuple[int, int, int, int, int]
+EXACT, LOWER, UPPER = range(3)
+TABLE_SIZE = 1 << 18
+HASH_PRIME = (1 << 61) - 1
+HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+# the depth stored for positions searched to the end of the game
+SOLVED = 1 << 30
+# bits per pit in a packed state; enough for any pit while the game has
+# fewer than 256 seeds
+STATE_WIDTH = 8
+
 
 def init(size: int, start: int) -> Tuple[List[int], List[int]]:
     player_side = [start for _ in range(size)]
@@ -14,29 +33,77 @@ def init(size: int, start: int) -> Tuple[List[int], List[int]]:
 
 
 def play(our: List[int], their: List[int], position: int) -> int:
+    return play_undoable(our, their, position)[0]
+
+
+# like play, but also returns what unplay needs to take the move back:
+# (position, seeds sown, seeds captured from their side), or None when
+# nothing was played
+def play_undoable(our: List[int], their: List[int],
+                  position: int) -> Tuple[int, Optional[Undo]]:
     if position > len(our) - 2 or position < 0:
-        return INVALID_POSITION
+        return INVALID_POSITION, None
     if our[position] == 0:
-        return EMPTY_POSITION
-    return distribution(our, their, position)
+        return EMPTY_POSITION, None
+    ball_count = our[position]
+    status, stolen = sow(our, their, position)
+    return status, (position, ball_count, stolen)
+
+
+def unplay(our: List[int], their: List[int], undo: Optional[Undo]) -> None:
+    if undo is None:
+        return
+    position, ball_count, stolen = undo
+    size = len(our) - 1
+    if stolen > 0:
+        last = (position + ball_count) % (2 * size + 1)
+        our[size] -= 1 + stolen
+        our[last] = 1
+        their[size - 1 - last] = stolen
+    spread(our, their, position, ball_count, -1)
+    our[position] = ball_count
 
 
 def distribution(our: List[int], their: List[int], position: int) -> int:
-    ball_count, our[position], pos = our[position], 0, 0
-    ball_count, pos = distribute_to_player(our, ball_count, position + 1)
-    if ball_count == 0:
-        steal_balls(our, their, pos)
-    while ball_count > 0:
-        ball_count, pos = distribute_to_player(their, ball_count,
-                                               isEnemy=True)
-        if ball_count == 0:
-            break
-        ball_count, pos = distribute_to_player(our, ball_count)
-        if ball_count == 0:
-            steal_balls(our, their, pos)
-    if pos == len(our) - 1:
-        return PLAY_AGAIN
-    return ROUND_OVER
+    return sow(our, their, position)[0]
+
+
+# the seeds go round a cycle of our pits and bank and their pits (their
+# bank is skipped), so a move is some full laps plus the first few pits
+# after position; returns the status and how many seeds were captured
+def sow(our: List[int], their: List[int], position: int) -> Tuple[int, int]:
+    size = len(our) - 1
+    ball_count, our[position] = our[position], 0
+    spread(our, their, position, ball_count, 1)
+    last = (position + ball_count) % (2 * size + 1)
+    if last == size:
+        return PLAY_AGAIN, 0
+    stolen = 0
+    if last < size:
+        if our[last] == 1:
+            stolen = their[size - 1 - last]
+        steal_balls(our, their, last)
+    return ROUND_OVER, stolen
+
+
+# adds (step 1) or takes back (step -1) the seeds sown from position
+def spread(our: List[int], their: List[int], position: int,
+           ball_count: int, step: int) -> None:
+    size = len(our) - 1
+    laps, rest = divmod(ball_count, 2 * size + 1)
+    if laps > 0:
+        for i in range(size + 1):
+            our[i] += step * laps
+        for i in range(size):
+            their[i] += step * laps
+    end = min(position + 1 + rest, size + 1)
+    for i in range(position + 1, end):
+        our[i] += step
+    rest -= end - position - 1
+    for i in range(min(rest, size)):
+        their[i] += step
+    for i in range(rest - size):
+        our[i] += step
 
 
 def steal_balls(our: List[int], their: List[int],
@@ -108,6 +175,273 @@ def player_moving(player_A: List[int], player_B: List[int]) -> bool:
     return True
 
 
+class SimulationStats:
+    def __init__(self) -> None:
+        self.games = 0
+        self.wins_a = 0
+        self.wins_b = 0
+        self.draws = 0
+        self.margin_sum = 0
+        self.margin_squares = 0
+
+    def add(self, scores: Tuple[int, int]) -> None:
+        margin = scores[0] - scores[1]
+        self.games += 1
+        if margin > 0:
+            self.wins_a += 1
+        elif margin < 0:
+            self.wins_b += 1
+        else:
+            self.draws += 1
+        self.margin_sum += margin
+        self.margin_squares += margin * margin
+
+    def merge(self, other: 'SimulationStats') -> None:
+        for name, value in vars(other).items():
+            setattr(self, name, getattr(self, name) + value)
+
+    def mean_margin(self) -> float:
+        return self.margin_sum / self.games if self.games else 0.0
+
+    def as_dict(self) -> Dict[str, float]:
+        stats: Dict[str, float] = dict(vars(self))
+        stats["mean_margin"] = self.mean_margin()
+        return stats
+
+
+def pick_nonempty(our: List[int], rng: Random) -> Optional[int]:
+    count = len(our) - 1 - our[:-1].count(0)
+    if count == 0:
+        return None
+    k = rng.randrange(count)
+    for i in range(len(our) - 1):
+        if our[i] != 0:
+            if k == 0:
+                return i
+            k -= 1
+    return None
+
+
+def quiet_moving(player_A: List[int], player_B: List[int],
+                 rng: Random) -> bool:
+    pos = pick_nonempty(player_A, rng)
+    if pos is None:
+        return False
+    while play(player_A, player_B, pos) == PLAY_AGAIN:
+        pos = pick_nonempty(player_A, rng)
+        if pos is None:
+            break
+    return True
+
+
+def quiet_game(size: int, start: int, rng: Random) -> Tuple[int, int]:
+    player_A, player_B = init(size, start)
+    while True:
+        if not quiet_moving(player_A, player_B, rng):
+            return result(player_A, player_B)
+        if not quiet_moving(player_B, player_A, rng):
+            return result(player_A, player_B)
+
+
+def simulate_chunk(job: Tuple[int, int, int, str]) -> SimulationStats:
+    size, start, games, seed = job
+    rng = Random(seed)
+    stats = SimulationStats()
+    for _ in range(games):
+        stats.add(quiet_game(size, start, rng))
+    return stats
+
+
+def simulate(size: int, start: int, games: int, seed: int = 0,
+             processes: int = 1) -> SimulationStats:
+    jobs = [(size, start, min(SIMULATION_CHUNK, games - first),
+             f"{seed}-{first}")
+            for first in range(0, games, SIMULATION_CHUNK)]
+    stats = SimulationStats()
+    if processes > 1:
+        with Pool(processes) as pool:
+            for part in pool.imap_unordered(simulate_chunk, jobs):
+                stats.merge(part)
+    else:
+        for job in jobs:
+            stats.merge(simulate_chunk(job))
+    return stats
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+# our pits and bank, then their pits and bank, as fields of width bits
+# from the lowest up; a different int for every state, so it can serve as
+# a dict key by itself
+def encode_state(our: List[int], their: List[int],
+                 width: int = STATE_WIDTH) -> int:
+    if width == 8:
+        return int.from_bytes(bytes(our + their), "little")
+    key = 0
+    for balls in reversed(our + their):
+        if balls < 0 or balls >> width:
+            raise ValueError(f"{balls} seeds do not fit in {width} bits")
+        key = key << width | balls
+    return key
+
+
+def decode_state(key: int, size: int,
+                 width: int = STATE_WIDTH) -> Tuple[List[int], List[int]]:
+    if width == 8:
+        fields = list(key.to_bytes(2 * (size + 1), "little"))
+    else:
+        mask = (1 << width) - 1
+        fields = [key >> (i * width) & mask for i in range(2 * (size + 1))]
+    return fields[:size + 1], fields[size + 1:]
+
+
+def state_bytes(our: List[int], their: List[int],
+                width: int = STATE_WIDTH) -> bytes:
+    return encode_state(our, their, width).to_bytes(
+        ((len(our) + len(their)) * width + 7) // 8, "little")
+
+
+def state_from_bytes(data: bytes, size: int, width: int = STATE_WIDTH
+                     ) -> Tuple[List[int], List[int]]:
+    return decode_state(int.from_bytes(data, "little"), size, width)
+
+
+# a fixed number of slots, indexed by the key; a slot keeps the entry
+# searched to the greater depth, unless it is the same position again
+class TranspositionTable:
+    def __init__(self, size: int = TABLE_SIZE) -> None:
+        self.slots: List[Optional[TableEntry]] = [None] * size
+
+    # packed states differ mostly in their low fields, so the key is
+    # folded and multiplied before it picks a slot
+    def index(self, key: int) -> int:
+        return (key % HASH_PRIME * HASH_MULTIPLIER >> 32) % len(self.slots)
+
+    def get(self, key: int) -> Optional[TableEntry]:
+        entry = self.slots[self.index(key)]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    def put(self, key: int, depth: int, value: int, bound: int,
+            move: int) -> None:
+        index = self.index(key)
+        entry = self.slots[index]
+        if entry is None or entry[0] == key or depth >= entry[1]:
+            self.slots[index] = (key, depth, value, bound, move)
+
+
+# iterative deepening negamax with alpha-beta pruning; values are seeds
+# of the side to move minus seeds of the other side, counting the banks
+# only until the game is over; an extra turn is a ply of the same player
+class Searcher:
+    def __init__(self, table: Optional[TranspositionTable] = None) -> None:
+        self.table = table if table is not None else TranspositionTable()
+        self.deadline = 0.0
+        self.nodes = 0
+        self.cut_off = False
+        self.width = STATE_WIDTH
+
+    def best_move(self, our: List[int], their: List[int],
+                  budget: float = 1.0, max_depth: int = 64) -> Optional[int]:
+        if all(balls == 0 for balls in our[:-1]):
+            return None
+        # moves are made and taken back on this one copy, which a timeout
+        # may leave half played
+        our, their = our.copy(), their.copy()
+        self.width = max(STATE_WIDTH, (sum(our) + sum(their)).bit_length())
+        self.deadline = perf_counter() + budget
+        best = None
+        for depth in range(1, max_depth + 1):
+            self.cut_off = False
+            try:
+                _, move = self.search(our, their, depth, -10 ** 9, 10 ** 9,
+                                      False)
+            except SearchTimeout:
+                break
+            best = move
+            if not self.cut_off:
+                break
+        if best is None:
+            best = self.ordered_moves(our, -1)[0]
+        return best
+
+    def ordered_moves(self, our: List[int], hint: int) -> List[int]:
+        size = len(our) - 1
+        cycle = 2 * size + 1
+        moves = [i for i in range(size) if our[i] != 0]
+        moves.sort(key=lambda i: (i != hint, (i + our[i]) % cycle != size,
+                                  -i))
+        return moves
+
+    def search(self, our: List[int], their: List[int], depth: int,
+               alpha: int, beta: int, again: bool) -> Tuple[int, int]:
+        self.nodes += 1
+        if self.nodes & 1023 == 0 and perf_counter() > self.deadline:
+            raise SearchTimeout()
+
+        if all(balls == 0 for balls in our[:-1]):
+            if again:
+                value, _ = self.search(their, our, depth, -beta, -alpha,
+                                       False)
+                return -value, -1
+            return our[-1] - their[-1] - sum(their[:-1]), -1
+        if depth == 0:
+            self.cut_off = True
+            return our[-1] - their[-1], -1
+
+        key = encode_state(our, their, self.width) << 1 | again
+        entry = self.table.get(key)
+        hint = -1
+        if entry is not None:
+            _, entry_depth, value, bound, hint = entry
+            if entry_depth >= depth and (
+                    bound == EXACT or
+                    (bound == LOWER and value >= beta) or
+                    (bound == UPPER and value <= alpha)):
+                if entry_depth < SOLVED:
+                    self.cut_off = True
+                return value, hint
+
+        # whether this subtree reaches the depth limit anywhere
+        outer_cut_off, self.cut_off = self.cut_off, False
+        start_alpha = alpha
+        best_value, best_move = -10 ** 9, -1
+        for move in self.ordered_moves(our, hint):
+            status, undo = play_undoable(our, their, move)
+            if status == PLAY_AGAIN:
+                value, _ = self.search(our, their, depth - 1, alpha, beta,
+                                       True)
+            else:
+                value, _ = self.search(their, our, depth - 1, -beta, -alpha,
+                                       False)
+                value = -value
+            unplay(our, their, undo)
+            if value > best_value:
+                best_value, best_move = value, move
+            alpha = max(alpha, value)
+            if alpha >= beta:
+                break
+
+        bound = EXACT
+        if best_value <= start_alpha:
+            bound = UPPER
+        elif best_value >= beta:
+            bound = LOWER
+        if not self.cut_off:
+            depth = SOLVED
+        self.cut_off = self.cut_off or outer_cut_off
+        self.table.put(key, depth, best_value, bound, best_move)
+        return best_value, best_move
+
+
+def best_move(our: List[int], their: List[int], budget: float = 1.0,
+              max_depth: int = 64) -> Optional[int]:
+    return Searcher().best_move(our, their, budget, max_depth)
+
+
 def main() -> None:
     # --- init ---
 
@@ -157,6 +491,121 @@ def main() -> None:
 
     assert random_choice([0, 0, 0, 1]) is None
 
+    # --- simulate ---
+
+    rng = Random(1)
+    assert {pick_nonempty([0, 2, 0, 5, 0], rng) for _ in range(50)} == {1, 3}
+    assert pick_nonempty([0, 0, 0, 1], rng) is None
+
+    for _ in range(100):
+        scores = quiet_game(4, 3, rng)
+        assert sum(scores) == 2 * 4 * 3
+
+    stats = simulate(6, 3, 2500, seed=7)
+    assert stats.games == 2500
+    assert stats.wins_a + stats.wins_b + stats.draws == 2500
+    assert stats.as_dict() == simulate(6, 3, 2500, seed=7).as_dict()
+    assert stats.as_dict() \
+        == simulate(6, 3, 2500, seed=7, processes=2).as_dict()
+    assert stats.as_dict() != simulate(6, 3, 2500, seed=8).as_dict()
+    assert simulate(6, 3, 0).as_dict()["mean_margin"] == 0
+
+    # --- sowing ---
+
+    our = [0, 0, 20, 0]
+    their = [1, 0, 2, 0]
+    assert play(our, their, 2) == ROUND_OVER
+    assert our == [3, 3, 2, 3]
+    assert their == [4, 3, 5, 0]
+
+    # --- unplay ---
+
+    rng = Random(4)
+    for _ in range(2000):
+        size = rng.randint(1, 6)
+        our = [rng.randint(0, 20) for _ in range(size + 1)]
+        their = [rng.randint(0, 20) for _ in range(size + 1)]
+        before = (our.copy(), their.copy())
+        position = rng.randint(-1, size)
+        status, undo = play_undoable(our, their, position)
+        after = (our.copy(), their.copy())
+        unplay(our, their, undo)
+        assert (our, their) == before
+        our_again, their_again = before[0].copy(), before[1].copy()
+        assert play(our_again, their_again, position) == status
+        assert (our_again, their_again) == after
+
+    our = [1, 0, 0, 0]
+    their = [0, 7, 0, 0]
+    assert play_undoable(our, their, 0) == (ROUND_OVER, (0, 1, 7))
+    assert our == [0, 0, 0, 8] and their == [0, 0, 0, 0]
+    unplay(our, their, (0, 1, 7))
+    assert our == [1, 0, 0, 0] and their == [0, 7, 0, 0]
+    assert play_undoable(our, their, 1) == (EMPTY_POSITION, None)
+
+    # --- encode_state ---
+
+    our, their = init(6, 3)
+    assert encode_state(our, their) == int.from_bytes(bytes(our + their),
+                                                      "little")
+    assert decode_state(encode_state(our, their), 6) == (our, their)
+    assert encode_state([1, 2, 3], [4, 5, 6], 3) \
+        == 1 | 2 << 3 | 3 << 6 | 4 << 9 | 5 << 12 | 6 << 15
+    assert decode_state(encode_state([1, 2, 3], [4, 5, 6], 3), 2, 3) \
+        == ([1, 2, 3], [4, 5, 6])
+    assert state_from_bytes(state_bytes([0, 300], [7, 0], 9), 1, 9) \
+        == ([0, 300], [7, 0])
+    assert state_bytes(our, their) == bytes(our + their)
+    assert state_from_bytes(state_bytes(our, their), 6) == (our, their)
+    assert encode_state([1, 0], [0, 0]) != encode_state([0, 0], [1, 0])
+    assert len({encode_state(*init(6, start)) for start in range(20)}) == 20
+    for bad in [1, 300], [1, -1]:
+        try:
+            encode_state(bad, [0, 0])
+            assert False
+        except ValueError:
+            pass
+        try:
+            encode_state(bad, [0, 0], 6)
+            assert False
+        except ValueError:
+            pass
+
+    # --- best_move ---
+
+    assert best_move([0, 0, 0, 5], [1, 1, 1, 0]) is None
+    assert best_move([1, 0, 2, 0], [9, 1, 1, 0]) == 0
+    assert best_move([0, 3, 1, 0], [1, 1, 1, 0]) == 2
+
+    table = TranspositionTable(4)
+    other = next(key for key in range(6, 100)
+                 if table.index(key) == table.index(5))
+    table.put(5, 3, 10, EXACT, 1)
+    table.put(other, 2, 20, EXACT, 0)
+    assert table.get(5) == (5, 3, 10, EXACT, 1) and table.get(other) is None
+    table.put(other, 3, 20, LOWER, 0)
+    assert table.get(5) is None
+    assert table.get(other) == (other, 3, 20, LOWER, 0)
+
+    rng = Random(3)
+    wins = 0
+    for _ in range(10):
+        player_A, player_B = init(4, 3)
+        searcher = Searcher()
+        while True:
+            move = searcher.best_move(player_A, player_B, 5.0, 4)
+            if move is None:
+                break
+            while play(player_A, player_B, move) == PLAY_AGAIN:
+                move = searcher.best_move(player_A, player_B, 5.0, 4)
+                if move is None:
+                    break
+            if not quiet_moving(player_B, player_A, rng):
+                break
+        score_A, score_B = result(player_A, player_B)
+        wins += score_A > score_B
+    assert wins >= 8
+
 
 if __name__ == '__main__':
     print(run_random_game(1, 1))
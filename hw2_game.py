@@ -6,6 +6,9 @@ import hw2 as student
 # game parameters; feel free to change them
 SIZE = 6
 START = 3
+# the buttons suggest the engine's move instead of a random one
+AI_PLAYER = False
+AI_BUDGET = 1.0
 
 BORDER = 32
 CELL_SIZE = 64
@@ -92,8 +95,12 @@ def click(event: tk.Event, canvas: tk.Canvas, game: Game) -> None:
 def highlight_random(event: tk.Event, canvas: tk.Canvas, game: Game) -> None:
     top = event.y_root < BOTTOM // 2
     row = game.top if top else game.bottom
+    other = game.bottom if top else game.top
 
-    result = student.random_choice(row)
+    if AI_PLAYER:
+        result = student.best_move(row, other, AI_BUDGET)
+    else:
+        result = student.random_choice(row)
     if result is None:
         draw(canvas, game, "Found no possible moves.")
         return
@@ -108,7 +115,8 @@ def highlight_random(event: tk.Event, canvas: tk.Canvas, game: Game) -> None:
         y = TOP + CELL_SIZE
         x = LEFT + (2 + result) * CELL_SIZE
 
-    draw(canvas, game, "Random move selected.")
+    draw(canvas, game,
+         "Engine move selected." if AI_PLAYER else "Random move selected.")
     draw_cell(canvas, x, y, row[result], fill="red")
 
 
@@ -123,7 +131,7 @@ def main() -> None:
     draw(canvas, game)
 
     for y in BORDER, BOTTOM + BORDER:
-        button = tk.Button(canvas, text="Random")
+        button = tk.Button(canvas, text="Engine" if AI_PLAYER else "Random")
         button.place(x=(LEFT + RIGHT) // 2, y=y, anchor=tk.CENTER)
         button.bind("<Button-1>",
                     lambda ev: highlight_random(ev, canvas, game))
@@ -1,10 +1,32 @@
+import csv
+import json
 import math
-from typing import List, Dict, Tuple, Set
+import os
+import sys
+import tempfile
+import threading
+from array import array
+from bisect import bisect_right
+from collections import Counter
+from contextlib import ExitStack
+from heapq import heapify, heappop, heappush
+from mmap import mmap, ACCESS_READ
+from random import Random
+from struct import Struct
+from typing import IO, Any, Iterable, Iterator, List, Dict, Optional, \
+    Tuple, Set, Union, overload
 
 Product = Tuple[str, int, int]
+MovementRow = Tuple[str, int, int, str]
+# a movement row plus the expiry of the package it touched
+Entry = Tuple[str, int, int, str, str]
+# item, amount, price limit and tag of a sale
+Order = Tuple[str, int, int, str]
 
 
 class Package:
+    __slots__ = ("amount", "price", "expiry")
+
     def __init__(self, amount: int, price: int, expiry: str):
         self.amount = amount
         self.price = price
@@ -12,6 +34,8 @@ class Package:
 
 
 class Movement:
+    __slots__ = ("item", "amount", "price", "tag")
+
     def __init__(self, item: str, amount: int, price: int, tag: str):
         self.item = item
         self.amount = amount
@@ -19,182 +43,501 @@ class Movement:
         self.tag = tag
 
 
-class Warehouse:
+# movements kept column by column in arrays, with items and tags interned
+# in one shared table; it can stand in for the list of Movement objects,
+# but indexing it builds a fresh Movement, so changing that one does not
+# change the store
+class MovementStore:
     def __init__(self) -> None:
+        self.items = array('L')
+        self.amounts = array('q')
+        self.prices = array('q')
+        self.tags = array('L')
+        self.names: List[str] = []
+        self.name_ids: Dict[str, int] = {}
+
+    def intern(self, name: str) -> int:
+        if name not in self.name_ids:
+            self.name_ids[name] = len(self.names)
+            self.names.append(name)
+        return self.name_ids[name]
+
+    def append(self, movement: Movement) -> None:
+        self.items.append(self.intern(movement.item))
+        self.amounts.append(movement.amount)
+        self.prices.append(movement.price)
+        self.tags.append(self.intern(movement.tag))
+
+    def extend(self, movements: Iterable[Movement]) -> None:
+        for movement in movements:
+            self.append(movement)
+
+    def __len__(self) -> int:
+        return len(self.amounts)
+
+    @overload
+    def __getitem__(self, index: int) -> Movement: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[Movement]: ...
+
+    def __getitem__(self, index: Union[int, slice]
+                    ) -> Union[Movement, List[Movement]]:
+        names = self.names
+        if isinstance(index, slice):
+            return [Movement(names[item], amount, price, names[tag])
+                    for item, amount, price, tag
+                    in zip(self.items[index], self.amounts[index],
+                           self.prices[index], self.tags[index])]
+        return Movement(names[self.items[index]], self.amounts[index],
+                        self.prices[index], names[self.tags[index]])
+
+    def pop(self, index: int = -1) -> Movement:
+        movement = self[index]
+        self.items.pop(index)
+        self.amounts.pop(index)
+        self.prices.pop(index)
+        self.tags.pop(index)
+        return movement
+
+    def __iter__(self) -> Iterator[Movement]:
+        for item, amount, price, tag in self.rows():
+            yield Movement(item, amount, price, tag)
+
+    def rows(self, start: int = 0,
+             stop: Optional[int] = None) -> Iterator[MovementRow]:
+        names = self.names
+        return zip(map(names.__getitem__, self.items[start:stop]),
+                   self.amounts[start:stop], self.prices[start:stop],
+                   map(names.__getitem__, self.tags[start:stop]))
+
+
+MovementLog = Union[List[Movement], MovementStore]
+# amount of every item at every price, as the history adds it up
+Stock = Dict[str, Dict[int, int]]
+
+CHECKPOINT_EVERY = 1024
+
+
+# journal records: a LENGTH prefix, then a RECORD header followed by the
+# item, tag and expiry of the package the movement touched, in UTF-8
+LENGTH = Struct("<I")
+RECORD = Struct("<qqHHH")
+SNAPSHOT_SUFFIX = ".snapshot"
+
+# columns of the CSV and JSONL dumps; an imported package without a tag
+# is recorded under IMPORT_TAG
+INVENTORY_FIELDS = ("item", "amount", "price", "expiry")
+HISTORY_FIELDS = ("item", "amount", "price", "tag")
+IMPORT_TAG = "IMPORT"
+EXPIRED_TAG = "EXPIRED"
+
+
+# append-only log of movements; records are only fsync-ed every
+# sync_every appends, or on sync() and close()
+class Journal:
+    def __init__(self, filename: str, sync_every: int = 256) -> None:
+        self.filename = filename
+        self.sync_every = sync_every
+        self.unsynced = 0
+        self.file: IO[bytes] = open(filename, "ab")
+
+    def append(self, movement: Movement, expiry: str) -> None:
+        self.extend([(movement, expiry)])
+
+    def extend(self, records: List[Tuple[Movement, str]]) -> None:
+        self.file.write(b"".join(encode_record(movement, expiry)
+                                 for movement, expiry in records))
+        self.unsynced += len(records)
+        if self.unsynced >= self.sync_every:
+            self.sync()
+
+    def sync(self) -> None:
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def size(self) -> int:
+        self.file.flush()
+        return self.file.tell()
+
+    def close(self) -> None:
+        self.sync()
+        self.file.close()
+
+
+def encode_record(movement: Movement, expiry: str) -> bytes:
+    texts = [text.encode() for text in (movement.item, movement.tag, expiry)]
+    payload = b"".join([RECORD.pack(movement.amount, movement.price,
+                                    *map(len, texts))] + texts)
+    return LENGTH.pack(len(payload)) + payload
+
+
+# yields (movement, expiry, offset of the next record) from offset on; a
+# record cut short by a crash ends the journal
+def read_journal(filename: str,
+                 offset: int = 0) -> Iterator[Tuple[Movement, str, int]]:
+    if not os.path.exists(filename) or os.path.getsize(filename) == 0:
+        return
+    with open(filename, "rb") as file:
+        with mmap(file.fileno(), 0, access=ACCESS_READ) as buffer:
+            end = len(buffer)
+            while offset + LENGTH.size <= end:
+                length, = LENGTH.unpack_from(buffer, offset)
+                start = offset + LENGTH.size
+                if start + length > end:
+                    return
+                amount, price, item_len, tag_len, expiry_len = \
+                    RECORD.unpack_from(buffer, start)
+                start += RECORD.size
+                item = buffer[start:start + item_len].decode()
+                start += item_len
+                tag = buffer[start:start + tag_len].decode()
+                start += tag_len
+                expiry = buffer[start:start + expiry_len].decode()
+                offset = start + expiry_len
+                yield Movement(item, amount, price, tag), expiry, offset
+
+
+class Warehouse:
+    def __init__(self, self_check: bool = False,
+                 journal: Optional[Journal] = None,
+                 snapshot_every: int = 0, columnar: bool = False) -> None:
         self.inventory: Dict[str, List[Package]] = {}
-        self.history: List[Movement] = []
+        self.history: MovementLog = MovementStore() if columnar else []
+        # running amount and amount * price of the stock of every item
+        self.stock_amount: Dict[str, int] = {}
+        self.stock_cost: Dict[str, int] = {}
+        self.self_check = self_check
+        self.journal = journal
+        self.snapshot_every = snapshot_every
+        self.since_snapshot = 0
+        # checkpoints[i] is the stock after the first i * checkpoint_every
+        # movements; they are made as queries reach them, which is fine as
+        # long as the history is only ever appended to
+        self.checkpoint_every = CHECKPOINT_EVERY
+        self.checkpoints: List[Stock] = [{}]
+        # (today, length of the history) for every remove_expired call
+        self.days: List[Tuple[str, int]] = []
+        # heap of (expiry as a number, item) of every stored package, so
+        # remove_expired only visits items that have something expired; a
+        # package that is sold out before it expires leaves its entry behind
+        self.expiries: List[Tuple[int, str]] = []
+        # the inventory the totals and the heap were built for; when a whole
+        # new inventory is assigned they are rebuilt before the next use
+        self.indexed_inventory = self.inventory
+
+    # every movement goes through here; expiry is that of the package it
+    # touched, which is what lets the journal rebuild the inventory
+    def record(self, item: str, amount: int, price: int, tag: str,
+               expiry: str) -> None:
+        self.record_many([(item, amount, price, tag, expiry)])
+
+    def record_many(self, entries: List[Entry]) -> None:
+        movements: List[Movement] = []
+        for item, amount, price, tag, _ in entries:
+            self.adjust_stock(item, amount, price)
+            movements.append(Movement(item, amount, price, tag))
+        self.history.extend(movements)
+        if self.journal is None:
+            return
+        self.journal.extend([(movement, entry[4])
+                             for movement, entry in zip(movements, entries)])
+        self.since_snapshot += len(entries)
+        if self.snapshot_every and self.since_snapshot >= self.snapshot_every:
+            self.save_snapshot()
+
+    # writes the inventory together with the journal offset it matches,
+    # so a restart only has to replay the journal from there
+    def save_snapshot(self) -> None:
+        if self.journal is None:
+            return
+        self.journal.sync()
+        snapshot = {
+            "offset": self.journal.size(),
+            "inventory": {item: [[pack.amount, pack.price, pack.expiry]
+                                 for pack in packages]
+                          for item, packages in self.inventory.items()},
+        }
+        filename = self.journal.filename + SNAPSHOT_SUFFIX
+        with open(filename + ".tmp", "w") as file:
+            json.dump(snapshot, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(filename + ".tmp", filename)
+        self.since_snapshot = 0
+
+    # redoes a journalled movement on the inventory (not on the history)
+    def apply(self, movement: Movement, expiry: str) -> None:
+        packages = self.inventory.setdefault(movement.item, [])
+        if movement.amount > 0:
+            packages.insert(count_newer(packages, expiry),
+                            Package(movement.amount, movement.price, expiry))
+            return
+        # a sale takes from the oldest (last) package first, while
+        # remove_expired records whole packages from the front of the
+        # expired tail, taking every package of that expiry with it
+        indices = range(len(packages) - 1, -1, -1)
+        if movement.tag == EXPIRED_TAG:
+            indices = range(len(packages))
+        for i in indices:
+            pack = packages[i]
+            if pack.expiry == expiry and pack.price == movement.price:
+                pack.amount += movement.amount
+                if pack.amount <= 0:
+                    packages.pop(i)
+                return
+
+    def adjust_stock(self, item: str, amount: int, price: int) -> None:
+        self.stock_amount[item] = self.stock_amount.get(item, 0) + amount
+        self.stock_cost[item] = \
+            self.stock_cost.get(item, 0) + amount * price
+
+    def ensure_indexed(self) -> None:
+        if self.inventory is not self.indexed_inventory:
+            self.reindex()
+
+    def reindex(self) -> None:
+        self.rebuild_stock()
+        self.rebuild_expiries()
+        self.indexed_inventory = self.inventory
+
+    # recounts the running totals, for when inventory was changed directly
+    def rebuild_stock(self) -> None:
+        self.stock_amount, self.stock_cost = self.rescan_stock()
+
+    def rescan_stock(self) -> Tuple[Dict[str, int], Dict[str, int]]:
+        amounts: Dict[str, int] = {}
+        costs: Dict[str, int] = {}
+        for item, packages in self.inventory.items():
+            amounts[item] = sum(pack.amount for pack in packages)
+            costs[item] = sum(pack.amount * pack.price for pack in packages)
+        return amounts, costs
+
+    def check_stock(self) -> None:
+        self.ensure_indexed()
+        amounts, costs = self.rescan_stock()
+        for item in self.inventory:
+            assert self.stock_amount.get(item, 0) == amounts[item], item
+            assert self.stock_cost.get(item, 0) == costs[item], item
 
     def store(self, item: str, amount: int, price: int, expiry: str,
               tag: str) -> None:
+        self.ensure_indexed()
+        package = Package(amount, price, expiry)
         if item in self.inventory:
-            self.inventory[item].append(Package(amount, price, expiry))
-            self.sort_by_expiry(item)
+            packages = self.inventory[item]
+            packages.insert(count_newer(packages, expiry), package)
         else:
-            self.inventory[item] = [Package(amount, price, expiry)]
-        self.history.append(Movement(item, amount, price, tag))
-
-    def sort_by_expiry(self, item: str) -> None:
-        j = len(self.inventory[item]) - 1
-        while j > 0 and \
-            self.inventory[item][j].expiry >= \
-                self.inventory[item][j-1].expiry:
-            self.inventory[item][j],\
-                self.inventory[item][j-1] = self.inventory[item][j-1],\
-                self.inventory[item][j]
-            j -= 1
-
+            self.inventory[item] = [package]
+        self.schedule(item, expiry)
+        self.record(item, amount, price, tag, expiry)
+
+    def schedule(self, item: str, expiry: str) -> None:
+        heappush(self.expiries, (int(expiry), item))
+
+    # the same as storing the entries one by one, but the packages of every
+    # item are sorted once at the end: ascending by expiry, stably, so that
+    # reversed they come out as store would have put them (newest first,
+    # the later stored of two with the same expiry in front)
+    def import_inventory(self, entries: Iterable[Entry]) -> int:
+        self.ensure_indexed()
+        recorded: List[Entry] = []
+        added: Dict[str, List[Package]] = {}
+        for item, amount, price, tag, expiry in entries:
+            added.setdefault(item, []).append(Package(amount, price, expiry))
+            self.schedule(item, expiry)
+            recorded.append((item, amount, price, tag, expiry))
+        for item, packages in added.items():
+            merged = self.inventory.get(item, [])[::-1] + packages
+            merged.sort(key=lambda pack: pack.expiry)
+            merged.reverse()
+            self.inventory[item] = merged
+        self.record_many(recorded)
+        return len(recorded)
+
+    # appends movements to the history only, as a log of the past that the
+    # inventory already reflects; so they are not journalled either
+    def import_history(self, rows: Iterable[MovementRow]) -> int:
+        movements = [Movement(item, amount, price, tag)
+                     for item, amount, price, tag in rows]
+        self.history.extend(movements)
+        return len(movements)
+
+    # refills the expiry heap, for when inventory was changed directly
+    def rebuild_expiries(self) -> None:
+        self.expiries = [(int(pack.expiry), item)
+                         for item, packages in self.inventory.items()
+                         for pack in packages]
+        heapify(self.expiries)
+
+    # (item, price, amount) for every item and price whose stock differs
+    # from what the history says it should be, amount being the surplus
     def find_inconsistencies(self) -> Set[Product]:
-        inconsistencies: List[Product] = []
-
-        if len(self.history) == 0:
-            if len(self.inventory) == 0:
-                return set()
-
-            for item, package in self.inventory.items():
-                if len(package) == 0:
-                    continue
-
-                package = sorted(package, key=lambda x: x.price)
-                prev_price = package[0].price
-                amount = package[0].amount
-                for pack in package[1:]:
-                    if pack.price != prev_price:
-                        inconsistencies.append((item, prev_price, amount))
-                        prev_price = pack.price
-                        amount = pack.amount
-                    else:
-                        amount += pack.amount
-                inconsistencies.append((item, prev_price, amount))
-            return set(inconsistencies)
-
-        hist = self.sum_same_price()
-        hist_len = len(hist)
-
-        for itemInv, package in self.inventory.items():
-            for pack in package:
-                for i in range(hist_len):
-                    if hist[i][0] == itemInv and hist[i][1] == pack.price:
-                        hist[i] = (hist[i][0], hist[i][1],
-                                   hist[i][2] - pack.amount)
-                        break
-                    if i == hist_len - 1:
-                        inconsistencies.append((itemInv, pack.price,
-                                                pack.amount))
-
-        inconsistencies.sort()
-        length = len(inconsistencies)
-        inconsistencies_set: Set[Product] = set()
-        if length > 0:
-            inconsistencies_set.add((inconsistencies[0][0],
-                                    inconsistencies[0][1],
-                                    inconsistencies[0][2]))
-
-        i = 1
-        while i < length:
-            prev_item = inconsistencies[i - 1][0]
-            prev_price = inconsistencies[i - 1][1]
-            item = inconsistencies[i][0]
-            price = inconsistencies[i][1]
-            if prev_item == item and price == prev_price:
-                amount = inconsistencies[i][2] + inconsistencies[i-1][2]
-                inconsistencies_set.remove((prev_item, prev_price,
-                                            inconsistencies[i-1][2]))
-                inconsistencies_set.add((item, price, amount))
-            else:
-                inconsistencies_set.add((item, price, inconsistencies[i][2]))
-            i += 1
-
-        for item, price, amount in hist:
+        balance: Dict[Tuple[str, int], int] = Counter()
+        for item, packages in self.inventory.items():
+            for pack in packages:
+                balance[(item, pack.price)] += pack.amount
+        for key, amount in self.history_totals().items():
+            balance[key] -= amount
+        return {(item, price, amount)
+                for (item, price), amount in balance.items() if amount != 0}
+
+    def history_totals(self) -> Dict[Tuple[str, int], int]:
+        totals: Dict[Tuple[str, int], int] = Counter()
+        for item, amount, price, _ in self.movement_rows():
+            totals[(item, price)] += amount
+        return totals
+
+    # (item, amount, price, tag) of every movement, without building
+    # Movement objects for a columnar history
+    def movement_rows(self, start: int = 0,
+                      stop: Optional[int] = None) -> Iterator[MovementRow]:
+        if isinstance(self.history, MovementStore):
+            return self.history.rows(start, stop)
+        return ((mov.item, mov.amount, mov.price, mov.tag)
+                for mov in self.history[start:stop])
+
+    # the stock after the first n movements of the history, replaying only
+    # the movements since the nearest checkpoint
+    def inventory_at(self, n: int) -> Stock:
+        assert 0 <= n <= len(self.history)
+        every = self.checkpoint_every
+        while len(self.checkpoints) <= n // every:
+            start = (len(self.checkpoints) - 1) * every
+            stock = copy_stock(self.checkpoints[-1])
+            replay(stock, self.movement_rows(start, start + every))
+            self.checkpoints.append(stock)
+        stock = copy_stock(self.checkpoints[n // every])
+        replay(stock, self.movement_rows(n - n % every, n))
+        return stock
+
+    def average_prices_at(self, n: int) -> Dict[str, float]:
+        avg_prices: Dict[str, float] = {}
+        for item, prices in self.inventory_at(n).items():
+            amount = sum(prices.values())
             if amount != 0:
-                inconsistencies_set.add((item, price, -amount))
-        return inconsistencies_set
+                avg_prices[item] = \
+                    sum(price * amount for price, amount
+                        in prices.items()) / amount
+        return avg_prices
 
-    # sums up elements with same item and price from history into one
-    def sum_same_price(self) -> List[Product]:
-        hist = self.history[:]
-        hist.sort(key=lambda x: (x.item, x.price))
-        sumed_up: List[Product] = []
-        amount = hist[0].amount
-        price = hist[0].price
-        item = hist[0].item
-
-        for h in hist[1:]:
-            if h.item == item and h.price == price:
-                amount += h.amount
-            else:
-                sumed_up.append((item, price, amount))
-                item = h.item
-                price = h.price
-                amount = h.amount
+    # how many movements had happened by the end of the given day, days
+    # being delimited by the calls to remove_expired
+    def movements_until(self, day: str) -> int:
+        index = bisect_right(self.days, (day, len(self.history)))
+        if index == len(self.days):
+            return len(self.history)
+        return self.days[index][1]
 
-        sumed_up.append((item, price, amount))
-        length = len(sumed_up)
-        i = 0
+    def inventory_on(self, day: str) -> Stock:
+        return self.inventory_at(self.movements_until(day))
 
-        while i < length:
-            if sumed_up[i][2] == 0:
-                sumed_up.pop(i)
-                length -= 1
-            i += 1
+    def average_prices_on(self, day: str) -> Dict[str, float]:
+        return self.average_prices_at(self.movements_until(day))
 
-        return sumed_up
+    # sums up elements with same item and price from history into one
+    def sum_same_price(self) -> List[Product]:
+        return sorted((item, price, amount)
+                      for (item, price), amount
+                      in self.history_totals().items() if amount != 0)
 
     def remove_expired(self, today: str) -> List[Package]:
+        self.ensure_indexed()
+        self.days.append((today, len(self.history)))
+        due: Set[str] = set()
+        while self.expiries and self.expiries[0][0] < int(today):
+            due.add(heappop(self.expiries)[1])
         removed: List[Package] = []
-        i = 0
-        for item, package in self.inventory.items():
-            for pack in package:
-                if pack.expiry < today:
-                    removed.append(pack)
-                    self.history.append(Movement(item,
-                                                 -pack.amount,
-                                                 pack.price,
-                                                 "EXPIRED"))
-            for pack in removed[i:]:
-                self.inventory[item].remove(pack)
-                i = len(removed)
+        if not due:
+            return removed
+        # still in inventory order, for the same removed list and history;
+        # recorded only once the packages are gone, so that a snapshot
+        # taken on the way never pairs them with a journal offset past
+        # their EXPIRED records
+        entries: List[Entry] = []
+        for item, packages in self.inventory.items():
+            if item not in due:
+                continue
+            kept = count_newer(packages, today, or_equal=True)
+            for pack in packages[kept:]:
+                removed.append(pack)
+                entries.append((item, -pack.amount, pack.price, EXPIRED_TAG,
+                                pack.expiry))
+            del packages[kept:]
+        self.record_many(entries)
         return removed
 
     def try_sell(self, item: str, amount: int, price: int,
                  tag: str) -> Tuple[int, int]:
+        return self.sell_many([(item, amount, price, tag)])[0]
+
+    # same results and history as calling try_sell on the orders one by
+    # one, but the packages of every item are walked once for all of its
+    # orders, and all the movements are recorded in one go at the end
+    def sell_many(self, orders: List[Order]) -> List[Tuple[int, int]]:
+        self.ensure_indexed()
+        results = [(0, 0) for _ in orders]
+        sent: List[List[Tuple[int, int, str]]] = [[] for _ in orders]
+        by_item: Dict[str, List[int]] = {}
+        for i, order in enumerate(orders):
+            by_item.setdefault(order[0], []).append(i)
+
+        for item, indices in by_item.items():
+            if item not in self.inventory:
+                continue
+            packages = self.inventory[item]
+            end = len(packages)
+            for i in indices:
+                _, amount, price, _ = orders[i]
+                results[i], end = self.sell_from(packages, end, amount,
+                                                 price, sent[i])
+            del packages[end:]
+
+        entries: List[Entry] = []
+        for (item, _, _, tag), parts in zip(orders, sent):
+            for send_amount, pack_price, expiry in parts:
+                entries.append((item, -send_amount, pack_price, tag, expiry))
+        self.record_many(entries)
+        return results
+
+    # sells from packages[:end], oldest (last) first; returns the amount
+    # and total price sold and how many packages are left, appending
+    # (amount, price, expiry) of every package it took from to sent
+    def sell_from(self, packages: List[Package], end: int, amount: int,
+                  price: int, sent: List[Tuple[int, int, str]]
+                  ) -> Tuple[Tuple[int, int], int]:
         used_amount = 0
         total_price = 0
-        breaker = False
-        if item not in self.inventory:
-            return (0, 0)
-        for pack in self.inventory[item][::-1]:
-            if (total_price + pack.price * pack.amount) / \
-                    (used_amount + pack.amount) > price:
+        while end > 0:
+            pack = packages[end - 1]
+            pack_amount = pack.amount
+            pack_price = pack.price
+            if (total_price + pack_price * pack_amount) / \
+                    (used_amount + pack_amount) > price:
                 if used_amount == 0:
-                    return 0, 0
-                max_amount = \
+                    return (0, 0), end
+                send_amount = \
                     self.fit_average(pack, total_price / used_amount,
                                      used_amount, price)
-                used_amount += max_amount
-                total_price += max_amount * pack.price
-                send_amount = max_amount
-                pack.amount -= max_amount
-                breaker = True
-            elif amount - pack.amount < 0:
-                pack.amount -= amount
-                used_amount += amount
-                total_price += amount * pack.price
+            elif amount < pack_amount:
                 send_amount = amount
-                breaker = True
             else:
-                used_amount += pack.amount
-                total_price += pack.price * pack.amount
-                amount -= pack.amount
-                send_amount = pack.amount
+                used_amount += pack_amount
+                total_price += pack_price * pack_amount
+                amount -= pack_amount
+                if pack_amount > 0:
+                    sent.append((pack_amount, pack_price, pack.expiry))
+                end -= 1
+                continue
 
+            pack.amount -= send_amount
+            used_amount += send_amount
+            total_price += send_amount * pack_price
             if send_amount > 0:
-                self.history.append(Movement(item,
-                                             -send_amount,
-                                             pack.price, tag))
-            if breaker:
-                break
-            self.inventory[item].pop()
-        return used_amount, total_price
+                sent.append((send_amount, pack_price, pack.expiry))
+            break
+        return (used_amount, total_price), end
 
     def fit_average(self, pack: Package, prev_avg_price: float,
                     prev_amount: int, price: int) -> int:
@@ -202,44 +545,41 @@ class Warehouse:
         return math.floor(x)
 
     def average_prices(self) -> Dict[str, float]:
+        self.ensure_indexed()
+        if self.self_check:
+            self.check_stock()
         avg_prices: Dict[str, float] = {}
         for item, inv in self.inventory.items():
-            amount = 0
-            total_cost = 0
             if len(inv) == 0:
                 continue
-            for pack in inv:
-                amount += pack.amount
-                total_cost += pack.price * pack.amount
-            avg_prices[item] = total_cost / amount
+            avg_prices[item] = self.stock_cost[item] / self.stock_amount[item]
         return avg_prices
 
+    # the tags that supplied the most of some item; movements are merged
+    # newest first into (item, tag, amount) entries, where a key starts a
+    # new entry once its amount drops below 1, found by a dict lookup
+    # instead of a scan of all the entries
     def best_suppliers(self) -> Set[str]:
         suppliers: Set[str] = set()
-        if len(self.history) == 0:
+        entries: List[Tuple[str, str, int]] = []
+        active: Dict[Tuple[str, str], int] = {}
+        for item, amount, _, tag in reversed(list(self.movement_rows())):
+            index = active.get((item, tag))
+            if index is None:
+                if amount >= 1:
+                    active[item, tag] = len(entries)
+                entries.append((item, tag, amount))
+                continue
+            amount += entries[index][2]
+            entries[index] = (item, tag, amount)
+            if amount < 1:
+                del active[item, tag]
+        if len(entries) == 0:
             return suppliers
-        hist = self.history.copy()
-        move = hist.pop()
-        supp_item_amount: List[Tuple[str, str, int]] = [(move.item, move.tag,
-                                                         move.amount)]
-        while len(hist) > 0:
-            move = hist.pop()
-            added = False
-            for i in range(len(supp_item_amount)):
-                if supp_item_amount[i][2] < 1:
-                    continue
-                if supp_item_amount[i][0] == move.item and\
-                        supp_item_amount[i][1] == move.tag:
-                    supp_item_amount[i] = (move.item, move.tag, move.amount +
-                                           supp_item_amount[i][2])
-                    added = True
-            if not added:
-                supp_item_amount.append((move.item, move.tag, move.amount))
-
-        supp_item_amount.sort()
-
-        max_item, max_tag, max_amount = supp_item_amount[0]
-        for item, tag, amount in supp_item_amount[1:]:
+
+        entries.sort()
+        max_item, max_tag, max_amount = entries[0]
+        for item, tag, amount in entries[1:]:
             if max_item == item:
                 if max_amount < amount:
                     max_tag = tag
@@ -254,6 +594,244 @@ class Warehouse:
         return suppliers
 
 
+# a Warehouse shared by several ingest and order workers: each item is
+# guarded by one of a fixed set of striped locks, so workers on different
+# items rarely wait for each other, and the movements of every call are
+# appended to the history in one batch under a lock of its own; locks are
+# always taken stripes first (in index order), then the history lock
+class ConcurrentWarehouse(Warehouse):
+    def __init__(self, stripes: int = 16, self_check: bool = False,
+                 journal: Optional[Journal] = None,
+                 snapshot_every: int = 0, columnar: bool = False) -> None:
+        super().__init__(self_check, journal, snapshot_every, columnar)
+        self.stripes = [threading.Lock() for _ in range(stripes)]
+        self.history_lock = threading.Lock()
+        self.checkpoint_lock = threading.Lock()
+        self.expiry_lock = threading.Lock()
+        self.snapshot_due = False
+
+    def stripes_for(self, items: Iterable[str]) -> List[threading.Lock]:
+        indices = {hash(item) % len(self.stripes) for item in items}
+        return [self.stripes[i] for i in sorted(indices)]
+
+    def hold(self, stack: ExitStack, locks: List[threading.Lock]) -> None:
+        for lock in locks:
+            stack.enter_context(lock)
+
+    def store(self, item: str, amount: int, price: int, expiry: str,
+              tag: str) -> None:
+        with ExitStack() as stack:
+            self.hold(stack, self.stripes_for([item]))
+            super().store(item, amount, price, expiry, tag)
+        self.write_due_snapshot()
+
+    def import_inventory(self, entries: Iterable[Entry]) -> int:
+        with ExitStack() as stack:
+            self.hold(stack, self.stripes)
+            count = super().import_inventory(entries)
+        self.write_due_snapshot()
+        return count
+
+    def import_history(self, rows: Iterable[MovementRow]) -> int:
+        with self.history_lock:
+            return super().import_history(rows)
+
+    # stores of different stripes push onto the one heap
+    def schedule(self, item: str, expiry: str) -> None:
+        with self.expiry_lock:
+            super().schedule(item, expiry)
+
+    def sell_many(self, orders: List[Order]) -> List[Tuple[int, int]]:
+        with ExitStack() as stack:
+            self.hold(stack, self.stripes_for(order[0] for order in orders))
+            results = super().sell_many(orders)
+        self.write_due_snapshot()
+        return results
+
+    def remove_expired(self, today: str) -> List[Package]:
+        with ExitStack() as stack:
+            self.hold(stack, self.stripes)
+            removed = super().remove_expired(today)
+        self.write_due_snapshot()
+        return removed
+
+    def record_many(self, entries: List[Entry]) -> None:
+        with self.history_lock:
+            super().record_many(entries)
+
+    # record_many runs with only some of the stripes held, so the snapshot
+    # it asks for is written once the caller has let go of them
+    def save_snapshot(self) -> None:
+        self.snapshot_due = True
+
+    def write_due_snapshot(self) -> None:
+        if not self.snapshot_due:
+            return
+        with ExitStack() as stack:
+            self.hold(stack, self.stripes + [self.history_lock])
+            if self.snapshot_due:
+                self.snapshot_due = False
+                super().save_snapshot()
+
+    # a plain Warehouse with the inventory, totals and history as they were
+    # at one moment; writers are only held up while the inventory is copied,
+    # since the history is append-only and its prefix can be read after
+    def snapshot(self) -> Warehouse:
+        copy = Warehouse()
+        with ExitStack() as stack:
+            self.hold(stack, self.stripes + [self.history_lock])
+            copy.inventory = {item: [Package(pack.amount, pack.price,
+                                             pack.expiry) for pack in packages]
+                              for item, packages in self.inventory.items()}
+            copy.stock_amount = dict(self.stock_amount)
+            copy.stock_cost = dict(self.stock_cost)
+            copy.expiries = list(self.expiries)
+            copy.indexed_inventory = copy.inventory
+            length = len(self.history)
+        copy.history = [Movement(*row)
+                        for row in self.movement_rows(0, length)]
+        return copy
+
+    def find_inconsistencies(self) -> Set[Product]:
+        return self.snapshot().find_inconsistencies()
+
+    def average_prices(self) -> Dict[str, float]:
+        with ExitStack() as stack:
+            self.hold(stack, self.stripes)
+            return super().average_prices()
+
+    def best_suppliers(self) -> Set[str]:
+        with self.history_lock:
+            return super().best_suppliers()
+
+    # the history prefix it reads is stable, only the checkpoints need
+    # guarding against another query
+    def inventory_at(self, n: int) -> Stock:
+        with self.checkpoint_lock:
+            return super().inventory_at(n)
+
+
+def copy_stock(stock: Stock) -> Stock:
+    return {item: dict(prices) for item, prices in stock.items()}
+
+
+def replay(stock: Stock, rows: Iterable[MovementRow]) -> None:
+    for item, amount, price, _ in rows:
+        prices = stock.setdefault(item, {})
+        prices[price] = prices.get(price, 0) + amount
+        if prices[price] == 0:
+            del prices[price]
+            if not prices:
+                del stock[item]
+
+
+# packages of an item are kept newest first, so the oldest ones sit at the
+# end; returns how many of them expire after expiry (or on it, with
+# or_equal), which is also where a package with that expiry belongs
+def count_newer(packages: List[Package], expiry: str,
+                or_equal: bool = False) -> int:
+    low, high = 0, len(packages)
+    while low < high:
+        middle = (low + high) // 2
+        if packages[middle].expiry > expiry or \
+                (or_equal and packages[middle].expiry == expiry):
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+# a warehouse rebuilt from its journal: the inventory comes from the last
+# snapshot plus the movements journalled after it, the history (unless
+# load_history is False) from the whole journal; new movements keep
+# being appended to the same journal
+def restore_warehouse(filename: str, load_history: bool = True,
+                      snapshot_every: int = 0,
+                      columnar: bool = False) -> Warehouse:
+    wh = Warehouse(snapshot_every=snapshot_every, columnar=columnar)
+    start = 0
+    if os.path.exists(filename + SNAPSHOT_SUFFIX):
+        with open(filename + SNAPSHOT_SUFFIX) as file:
+            snapshot = json.load(file)
+        start = snapshot["offset"]
+        wh.inventory = {item: [Package(*pack) for pack in packages]
+                        for item, packages in snapshot["inventory"].items()}
+
+    end = 0 if load_history else start
+    position = end
+    for movement, expiry, end in read_journal(filename, end):
+        if load_history:
+            wh.history.append(movement)
+        if position >= start:
+            wh.apply(movement, expiry)
+        position = end
+
+    # drop a record cut short by a crash, so appends start on a boundary
+    if os.path.exists(filename) and os.path.getsize(filename) > end:
+        os.truncate(filename, end)
+    wh.reindex()
+    wh.journal = Journal(filename)
+    return wh
+
+
+# rows of a CSV file with a header line, or of a JSONL file (by its
+# suffix), as dicts; read lazily, one line at a time
+def read_table(filename: str) -> Iterator[Dict[str, Any]]:
+    with open(filename, newline="") as file:
+        if filename.endswith(".jsonl"):
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        elif filename.endswith(".csv"):
+            yield from csv.DictReader(file)
+        else:
+            raise ValueError(f"{filename} is neither .csv nor .jsonl")
+
+
+def write_table(filename: str, fields: Tuple[str, ...],
+                rows: Iterable[Tuple[Any, ...]]) -> int:
+    count = 0
+    with open(filename, "w", newline="") as file:
+        if filename.endswith(".jsonl"):
+            for row in rows:
+                file.write(json.dumps(dict(zip(fields, row))) + "\n")
+                count += 1
+        elif filename.endswith(".csv"):
+            writer = csv.writer(file)
+            writer.writerow(fields)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        else:
+            raise ValueError(f"{filename} is neither .csv nor .jsonl")
+    return count
+
+
+def load_inventory(warehouse: Warehouse, filename: str) -> int:
+    return warehouse.import_inventory(
+        (row["item"], int(row["amount"]), int(row["price"]),
+         row.get("tag") or IMPORT_TAG, str(row["expiry"]))
+        for row in read_table(filename))
+
+
+def load_history(warehouse: Warehouse, filename: str) -> int:
+    return warehouse.import_history(
+        (row["item"], int(row["amount"]), int(row["price"]), row["tag"])
+        for row in read_table(filename))
+
+
+# oldest packages first, the order that load_inventory puts back as it was
+def dump_inventory(warehouse: Warehouse, filename: str) -> int:
+    return write_table(filename, INVENTORY_FIELDS,
+                       ((item, pack.amount, pack.price, pack.expiry)
+                        for item, packages in warehouse.inventory.items()
+                        for pack in reversed(packages)))
+
+
+def dump_history(warehouse: Warehouse, filename: str) -> int:
+    return write_table(filename, HISTORY_FIELDS, warehouse.movement_rows())
+
+
 def print_warehouse(warehouse: Warehouse) -> None:
     print("===== INVENTORY =====", end="")
     for item, pkgs in warehouse.inventory.items():
@@ -265,9 +843,9 @@ def print_warehouse(warehouse: Warehouse) -> None:
     print("\n===== HISTORY ======")
     print("    item     amount  price   tag")
     print("-------------------------------------------")
-    for mov in warehouse.history:
-        print(f" {mov.item:^11}   {mov.amount:4d}   "
-              f"{mov.price:4d}   {mov.tag}")
+    for item, amount, price, tag in warehouse.movement_rows():
+        print(f" {item:^11}   {amount:4d}   "
+              f"{price:4d}   {tag}")
 
 
 def example_warehouse() -> Warehouse:
@@ -386,12 +964,472 @@ def test5() -> None:
         == {'UniCORN & co.', 'G. P. a C.', 'RICE Unlimited'}
 
 
+def test6() -> None:
+    wh = example_warehouse()
+    assert [pack.expiry for pack in wh.inventory['rice']] \
+        == ['20771023', '20220202', '20220202', '20211111']
+    assert [pack.price for pack in wh.inventory['rice']] == [158, 14, 17, 9]
+
+    wh.store('rice', 5, 20, '20220202', 'Late Rice')
+    wh.store('rice', 6, 21, '20000101', 'Old Rice')
+    assert [pack.price for pack in wh.inventory['rice']] \
+        == [158, 20, 14, 17, 9, 21]
+
+    removed = wh.remove_expired('20220202')
+    assert [(pack.price, pack.expiry) for pack in removed] \
+        == [(9, '20211111'), (21, '20000101'), (7, '20211101')]
+    assert [pack.price for pack in wh.inventory['rice']] == [158, 20, 14, 17]
+    assert [mov.price for mov in wh.history[-3:]] == [9, 21, 7]
+    assert wh.remove_expired('20220202') == []
+
+
+def test7() -> None:
+    wh = example_warehouse()
+    assert wh.sum_same_price()[:3] == [('corn', 15, 70), ('peas', 1, 9774),
+                                       ('peas', 7, 64)]
+
+    wh.store('rice', 10, 17, '20230101', 'ACME Rice Ltd.')
+    wh.store('rice', 10, 17, '20230102', 'ACME Rice Ltd.')
+    wh.history.pop()
+    wh.history.pop()
+    assert wh.find_inconsistencies() == {('rice', 17, 20)}
+
+    wh.history.append(Movement('rice', 20, 17, 'ACME Rice Ltd.'))
+    wh.history.append(Movement('oats', 5, 3, 'Ghost Oats'))
+    assert wh.find_inconsistencies() == {('oats', 3, -5)}
+
+    wh = Warehouse()
+    assert wh.find_inconsistencies() == set()
+    assert wh.sum_same_price() == []
+
+
+def test8() -> None:
+    wh = example_warehouse()
+    wh.self_check = True
+    wh.try_sell('rice', 500, 16, 'Pear Shop')
+    wh.try_sell('corn', 20, 100, 'Pear Shop')
+    wh.remove_expired('20220301')
+    wh.store('peas', 10, 3, '20230101', 'G. P. a C.')
+    prices = wh.average_prices()
+    assert prices['corn'] == 15
+    assert math.isclose(prices['rice'], 158)
+    assert wh.stock_amount['rice'] == 198
+
+    wh.inventory['corn'][0].amount = 1
+    try:
+        wh.average_prices()
+    except AssertionError:
+        pass
+    else:
+        assert False, "self check should have caught the change"
+    wh.rebuild_stock()
+    assert wh.average_prices()['corn'] == 15
+
+
+def test9() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "journal")
+        journal = Journal(filename, sync_every=4)
+        wh = Warehouse(journal=journal, snapshot_every=3)
+        wh.store("rice", 100, 17, "20220202", "ACME Rice Ltd.")
+        wh.store("rice", 200, 158, "20771023", "RICE Unlimited")
+        wh.store("peas", 64, 7, "20211101", "Discount Peas")
+        wh.store("rice", 42, 9, "20211111", "ACME Rice Ltd.")
+        wh.try_sell('rice', 500, 16, 'Pear Shop')
+        wh.save_snapshot()
+        wh.remove_expired('20220301')
+        wh.store('peas', 10, 3, '20230101', 'G. P. a C.')
+        wh.try_sell('peas', 5, 3, 'Pea Shop')
+        journal.close()
+
+        for load_history in True, False:
+            restored = restore_warehouse(filename, load_history)
+            assert restored.inventory.keys() == wh.inventory.keys()
+            for item, packages in wh.inventory.items():
+                assert [(pack.amount, pack.price, pack.expiry)
+                        for pack in restored.inventory[item]] \
+                    == [(pack.amount, pack.price, pack.expiry)
+                        for pack in packages]
+            assert restored.average_prices() == wh.average_prices()
+            assert len(restored.history) \
+                == (len(wh.history) if load_history else 0)
+            if load_history:
+                assert restored.find_inconsistencies() == set()
+            assert restored.journal is not None
+            restored.journal.close()
+
+        expiring = os.path.join(directory, "expiring")
+        journal = Journal(expiring)
+        spoiling = Warehouse(journal=journal, snapshot_every=3)
+        spoiling.store("peas", 5, 3, "20220103", "Discount Peas")
+        spoiling.store("peas", 6, 4, "20220104", "Discount Peas")
+        spoiling.store("corn", 7, 5, "20220105", "UniCORN & co.")
+        spoiling.remove_expired("20230101")
+        journal.close()
+        restored = restore_warehouse(expiring)
+        assert all(packages == [] for packages in restored.inventory.values())
+        assert restored.find_inconsistencies() == set()
+        assert restored.journal is not None
+        restored.journal.close()
+
+        twins = os.path.join(directory, "twins")
+        journal = Journal(twins)
+        spoiling = Warehouse(journal=journal)
+        spoiling.store("rice", 5, 10, "20220101", "ACME Rice Ltd.")
+        spoiling.store("rice", 3, 10, "20220101", "RICE Unlimited")
+        spoiling.store("rice", 4, 1, "20240101", "RICE Unlimited")
+        spoiling.remove_expired("20230101")
+        journal.close()
+        restored = restore_warehouse(twins)
+        assert [(pack.amount, pack.price, pack.expiry)
+                for pack in restored.inventory["rice"]] \
+            == [(4, 1, "20240101")]
+        assert restored.average_prices() == {"rice": 1}
+        assert restored.journal is not None
+        restored.journal.close()
+
+        with open(filename, "ab") as file:
+            file.write(LENGTH.pack(100) + b"torn")
+        restored = restore_warehouse(filename)
+        restored.store('oats', 1, 1, '20240101', 'Oat Farm')
+        assert restored.journal is not None
+        restored.journal.close()
+        assert len(restore_warehouse(filename).history) \
+            == len(wh.history) + 1
+
+
+def test10() -> None:
+    wh = example_warehouse()
+    columnar = Warehouse(columnar=True)
+    columnar.store("rice", 100, 17, "20220202", "ACME Rice Ltd.")
+    columnar.store("corn", 70, 15, "20220315", "UniCORN & co.")
+    columnar.store("rice", 200, 158, "20771023", "RICE Unlimited")
+    columnar.store("peas", 9774, 1, "20220921", "G. P. a C.")
+    columnar.store("rice", 90, 14, "20220202", "Theorem's Rice")
+    columnar.store("peas", 64, 7, "20211101", "Discount Peas")
+    columnar.store("rice", 42, 9, "20211111", "ACME Rice Ltd.")
+    for warehouse in wh, columnar:
+        assert warehouse.try_sell('rice', 500, 16, 'Pear Shop') \
+            == (42 + 100 + 90 + 2, 42 * 9 + 100 * 17 + 90 * 14 + 2 * 158)
+        warehouse.remove_expired('20220301')
+
+    assert isinstance(columnar.history, MovementStore)
+    assert list(columnar.movement_rows()) == list(wh.movement_rows())
+    assert len(columnar.history) == len(wh.history) == 12
+    assert columnar.history[3].tag == 'G. P. a C.'
+    assert [(mov.item, mov.price) for mov in columnar.history[-3:]] \
+        == [(mov.item, mov.price) for mov in wh.history[-3:]]
+    assert [mov.tag for mov in columnar.history[::5]] \
+        == [mov.tag for mov in wh.history[::5]]
+    assert [mov.amount for mov in columnar.history] \
+        == [mov.amount for mov in wh.history]
+    assert columnar.find_inconsistencies() == set()
+    assert columnar.best_suppliers() == wh.best_suppliers()
+    popped = columnar.history.pop()
+    assert (popped.item, popped.amount, popped.price, popped.tag) \
+        == ('peas', -64, 7, 'EXPIRED')
+    assert len(columnar.history) == 11
+    assert columnar.find_inconsistencies() == {('peas', 7, -64)}
+    assert len(columnar.history.names) == 11
+
+
+def test11() -> None:
+    orders = [('rice', 50, 16, 'A'), ('peas', 100, 5, 'B'),
+              ('rice', 100, 16, 'C'), ('oats', 1, 1, 'D'),
+              ('rice', 10, 9, 'E'), ('peas', 9000, 2, 'F'),
+              ('rice', 1000, 200, 'G')]
+    one_by_one = example_warehouse()
+    expected = [one_by_one.try_sell(*order) for order in orders]
+
+    wh = example_warehouse()
+    assert wh.sell_many(orders) == expected
+    assert list(wh.movement_rows()) == list(one_by_one.movement_rows())
+    assert wh.average_prices() == one_by_one.average_prices()
+    for item, packages in one_by_one.inventory.items():
+        assert [(pack.amount, pack.expiry) for pack in wh.inventory[item]] \
+            == [(pack.amount, pack.expiry) for pack in packages]
+    assert wh.find_inconsistencies() == set()
+    assert wh.sell_many([]) == []
+
+
+def test12() -> None:
+    wh = Warehouse(self_check=True)
+    assert wh.best_suppliers() == set()
+    wh.store('rice', 10, 5, '20300101', 'A')
+    wh.store('rice', 6, 5, '20300101', 'B')
+    wh.store('rice', 4, 5, '20300202', 'B')
+    wh.store('oats', 3, 2, '20300101', 'C')
+    wh.store('oats', 1, 2, '20300101', 'D')
+    assert wh.best_suppliers() == {'A', 'B', 'C'}
+    wh.store('oats', 2, 2, '20300303', 'D')
+    assert wh.best_suppliers() == {'A', 'B', 'C', 'D'}
+    wh.history.append(Movement('oats', 7, 2, 'E'))
+    assert wh.best_suppliers() == {'A', 'B', 'D', 'E'}
+
+    # a sale tagged like a supplier is merged into that supplier's amount
+    wh = Warehouse()
+    wh.store('rice', 10, 5, '20300101', 'A')
+    wh.store('rice', 10, 5, '20300101', 'B')
+    wh.try_sell('rice', 15, 10, 'A')
+    assert wh.best_suppliers() == {'B'}
+
+
+def test13() -> None:
+    items = ['rice', 'corn', 'peas', 'oats', 'beans', 'wheat']
+    wh = ConcurrentWarehouse(stripes=4, self_check=True)
+    sold: List[Tuple[int, int]] = []
+    checks: List[Set[Product]] = []
+    done = threading.Event()
+
+    def ingest(worker: int) -> None:
+        rng = Random(worker)
+        for _ in range(300):
+            wh.store(rng.choice(items), rng.randint(1, 20),
+                     rng.randint(1, 30), f"2030{rng.randint(1, 12):02d}01",
+                     f"in{worker}")
+
+    def order(worker: int) -> None:
+        rng = Random(-worker)
+        for _ in range(200):
+            orders = [(rng.choice(items), rng.randint(1, 30),
+                       rng.randint(5, 30), f"out{worker}")
+                      for _ in range(rng.randint(1, 3))]
+            sold.extend(wh.sell_many(orders))
+
+    def check() -> None:
+        while not done.is_set():
+            checks.append(wh.find_inconsistencies())
+            wh.snapshot().check_stock()
+            wh.average_prices()
+
+    switch = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    try:
+        workers = [threading.Thread(target=ingest, args=(i,))
+                   for i in range(3)]
+        workers += [threading.Thread(target=order, args=(i,))
+                    for i in range(3)]
+        checker = threading.Thread(target=check)
+        checker.start()
+        for worker in workers:
+            worker.start()
+        wh.remove_expired('20300301')
+        for worker in workers:
+            worker.join()
+        done.set()
+        checker.join()
+    finally:
+        sys.setswitchinterval(switch)
+
+    assert checks and all(found == set() for found in checks)
+    assert wh.find_inconsistencies() == set()
+    wh.check_stock()
+    stored = sum(amount for _, amount, _, tag in wh.movement_rows()
+                 if tag.startswith('in'))
+    sales = [row for row in wh.movement_rows() if row[3].startswith('out')]
+    expired = sum(amount for _, amount, _, tag in wh.movement_rows()
+                  if tag == 'EXPIRED')
+    assert sum(amount for amount, _ in sold) \
+        == -sum(row[1] for row in sales)
+    assert sum(total for _, total in sold) \
+        == -sum(row[1] * row[2] for row in sales)
+    assert stored + expired - sum(amount for amount, _ in sold) \
+        == sum(wh.stock_amount.values())
+    assert len(wh.history) == 900 + len(sales) + \
+        sum(row[3] == 'EXPIRED' for row in wh.movement_rows())
+    for packages in wh.inventory.values():
+        assert all(pack.amount > 0 for pack in packages)
+        assert [pack.expiry for pack in packages] \
+            == sorted((pack.expiry for pack in packages), reverse=True)
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "journal")
+        journal = Journal(filename)
+        journalled = ConcurrentWarehouse(journal=journal, snapshot_every=3)
+        journalled.store("rice", 100, 17, "20220202", "ACME Rice Ltd.")
+        journalled.store("peas", 64, 7, "20211101", "Discount Peas")
+        journalled.sell_many([('rice', 30, 20, 'Pear Shop'),
+                              ('peas', 4, 9, 'Pea Shop')])
+        assert not journalled.snapshot_due
+        assert os.path.exists(filename + SNAPSHOT_SUFFIX)
+        journalled.store("rice", 42, 9, "20211111", "ACME Rice Ltd.")
+        journal.close()
+        restored = restore_warehouse(filename)
+        assert restored.average_prices() == journalled.average_prices()
+        assert restored.best_suppliers() == journalled.best_suppliers()
+        assert restored.journal is not None
+        restored.journal.close()
+
+
+def test14() -> None:
+    wh = example_warehouse()
+    wh.checkpoint_every = 3
+    wh.remove_expired('20211201')
+    wh.try_sell('rice', 150, 30, 'Pear Shop')
+    wh.store('peas', 10, 3, '20230101', 'G. P. a C.')
+    wh.remove_expired('20220210')
+    wh.try_sell('peas', 500, 2, 'Pea Shop')
+    wh.store('corn', 5, 20, '20230101', 'UniCORN & co.')
+
+    rows = list(wh.movement_rows())
+    for n in range(len(rows), -1, -1):
+        stock: Dict[Tuple[str, int], int] = Counter()
+        for item, amount, price, _ in rows[:n]:
+            stock[(item, price)] += amount
+        expected: Stock = {}
+        for (item, price), amount in stock.items():
+            if amount != 0:
+                expected.setdefault(item, {})[price] = amount
+        assert wh.inventory_at(n) == expected
+    assert len(wh.checkpoints) == len(rows) // 3 + 1
+
+    assert wh.inventory_at(0) == {}
+    assert wh.inventory_at(1) == {'rice': {17: 100}}
+    assert wh.average_prices_at(2) == {'rice': 17, 'corn': 15}
+    assert wh.average_prices_at(len(rows)) == wh.average_prices()
+
+    assert wh.days == [('20211201', 7), ('20220210', 12)]
+    assert wh.movements_until('20211130') == 7
+    assert wh.movements_until('20211201') == 12
+    assert wh.movements_until('20220209') == 12
+    assert wh.movements_until('20220210') == len(rows)
+    assert wh.inventory_on('20211201') \
+        == {'rice': {158: 200, 14: 40}, 'corn': {15: 70},
+            'peas': {1: 9774, 3: 10}}
+    assert wh.average_prices_on('20211201')['rice'] == 134
+    assert wh.inventory_on('20300101') == wh.inventory_at(len(rows))
+
+
+def test15() -> None:
+    rng = Random(15)
+    wh = Warehouse()
+    for day in range(1, 29):
+        for _ in range(20):
+            item = rng.choice(['rice', 'corn', 'peas', 'oats'])
+            if rng.random() < 0.7:
+                wh.store(item, rng.randint(1, 20), rng.randint(1, 30),
+                         f"202203{rng.randint(1, 31):02d}", 'Farm')
+            else:
+                wh.try_sell(item, rng.randint(1, 40), 30, 'Shop')
+        today = f"202203{day:02d}"
+        expected = [(item, pack.amount, pack.price, pack.expiry)
+                    for item, packages in wh.inventory.items()
+                    for pack in packages if pack.expiry < today]
+        before = len(wh.history)
+        removed = wh.remove_expired(today)
+        assert [(pack.amount, pack.price, pack.expiry) for pack in removed] \
+            == [row[1:] for row in expected]
+        assert [(item, -amount, price, 'EXPIRED')
+                for item, amount, price, _ in expected] \
+            == list(wh.movement_rows(before))
+        assert all(expiry >= int(today) for expiry, _ in wh.expiries)
+    assert wh.find_inconsistencies() == set()
+
+    wh.inventory['salt'] = [Package(5, 1, '20220101')]
+    assert wh.remove_expired('20220102') == []
+    wh.rebuild_expiries()
+    assert [pack.expiry for pack in wh.remove_expired('20220102')] \
+        == ['20220101']
+
+    wh.inventory = {'salt': [Package(4, 3, '20220110'),
+                             Package(2, 6, '20220105')]}
+    assert wh.average_prices() == {'salt': 4}
+    assert [pack.expiry for pack in wh.remove_expired('20220106')] \
+        == ['20220105']
+    assert wh.average_prices() == {'salt': 3}
+
+
+def test16() -> None:
+    # an order met exactly by whole packages still goes on to the next
+    # one, which tops it up as far as the average allows
+    wh = example_warehouse()
+    assert wh.try_sell('rice', 42, 12, 'Pear Shop') == (42 + 25, 803)
+    assert [(pack.amount, pack.price) for pack in wh.inventory['rice']] \
+        == [(200, 158), (90, 14), (75, 17)]
+    assert wh.try_sell('rice', 42, 20, 'Pear Shop') == (42, 42 * 17)
+
+    wh = example_warehouse()
+    assert wh.try_sell('rice', 142, 20, 'Pear Shop') == (142, 2078)
+    assert [(pack.amount, pack.price) for pack in wh.inventory['rice']] \
+        == [(200, 158), (90, 14)]
+    assert list(wh.movement_rows(7)) \
+        == [('rice', -42, 9, 'Pear Shop'), ('rice', -100, 17, 'Pear Shop')]
+    assert wh.find_inconsistencies() == set()
+
+
+def test17() -> None:
+    rng = Random(17)
+    entries: List[Entry] = [(rng.choice(['rice', 'corn', 'peas']),
+                             rng.randint(1, 50), rng.randint(1, 30),
+                             rng.choice('ABC'), f"2022030{rng.randint(1, 5)}")
+                            for _ in range(200)]
+    one_by_one = example_warehouse()
+    for item, amount, price, tag, expiry in entries:
+        one_by_one.store(item, amount, price, expiry, tag)
+    wh = example_warehouse()
+    assert wh.import_inventory(entries) == 200
+    for item, packages in one_by_one.inventory.items():
+        assert [(pack.amount, pack.price, pack.expiry)
+                for pack in wh.inventory[item]] \
+            == [(pack.amount, pack.price, pack.expiry) for pack in packages]
+    assert list(wh.movement_rows()) == list(one_by_one.movement_rows())
+    assert wh.average_prices() == one_by_one.average_prices()
+    assert wh.best_suppliers() == one_by_one.best_suppliers()
+    assert wh.remove_expired('20220304') != []
+    assert wh.find_inconsistencies() == set()
+    wh.check_stock()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for suffix in ".csv", ".jsonl":
+            inventory = os.path.join(directory, "inventory" + suffix)
+            history = os.path.join(directory, "history" + suffix)
+            assert dump_inventory(wh, inventory) \
+                == sum(map(len, wh.inventory.values()))
+            assert dump_history(wh, history) == len(wh.history)
+
+            loaded = Warehouse()
+            load_inventory(loaded, inventory)
+            assert [(item, [(pack.amount, pack.price, pack.expiry)
+                            for pack in packages])
+                    for item, packages in loaded.inventory.items()] \
+                == [(item, [(pack.amount, pack.price, pack.expiry)
+                            for pack in packages])
+                    for item, packages in wh.inventory.items()]
+            assert loaded.average_prices() == wh.average_prices()
+            assert {tag for _, _, _, tag in loaded.movement_rows()} \
+                == {IMPORT_TAG}
+
+            restored = Warehouse(columnar=True)
+            assert load_history(restored, history) == len(wh.history)
+            assert list(restored.movement_rows()) \
+                == list(wh.movement_rows())
+            assert restored.best_suppliers() == wh.best_suppliers()
+
+        with open(os.path.join(directory, "more.csv"), "w") as file:
+            file.write("expiry,price,item,amount,tag\n"
+                       "20230101,3,oats,7,Oat Farm\n")
+        assert load_inventory(wh, os.path.join(directory, "more.csv")) == 1
+        assert wh.best_suppliers() >= {'Oat Farm'}
+
+
 if __name__ == '__main__':
     test1()
     test2()
     test3()
     test4()
     test5()
+    test6()
+    test7()
+    test8()
+    test9()
+    test10()
+    test11()
+    test12()
+    test13()
+    test14()
+    test15()
+    test16()
+    test17()
     wh = Warehouse()
     wh.history = [Movement('rice', 1, 16842753, 'B'), Movement('rice', 257, 2, 'A'),
                     Movement('rice', 2, 67109121, 'A'), Movement('peas', 2, 259, 'BH'),
@@ -0,0 +1,124 @@
+import argparse
+from random import Random
+from time import perf_counter
+from typing import Dict, Iterable, List, Set, Tuple
+
+# change hw4 below if your file name is different
+from hw4 import MovementRow, Warehouse
+
+SIZES = [1000, 2000, 4000, 8000]
+ITEMS = 20
+TAGS = 50
+SEED = 111
+QUADRATIC_LIMIT = 8000
+
+
+# a warehouse with movements stores and sales of random items and tags
+def random_warehouse(movements: int, items: int, tags: int,
+                     rng: Random) -> Warehouse:
+    wh = Warehouse()
+    for _ in range(movements):
+        item = f"item{rng.randrange(items)}"
+        tag = f"tag{rng.randrange(tags)}"
+        if rng.random() < 0.7:
+            wh.store(item, rng.randint(1, 100), rng.randint(1, 50),
+                     f"2030{rng.randint(1, 12):02d}01", tag)
+        else:
+            wh.try_sell(item, rng.randint(1, 50), rng.randint(10, 50), tag)
+    return wh
+
+
+# best_suppliers as it was before the dict lookup, which merges every
+# movement into a list of (item, tag, amount) by a linear scan
+def quadratic_best_suppliers(rows: Iterable[MovementRow]) -> Set[str]:
+    suppliers: Set[str] = set()
+    hist = list(rows)
+    if len(hist) == 0:
+        return suppliers
+    move_item, move_amount, _, move_tag = hist.pop()
+    supp_item_amount: List[Tuple[str, str, int]] = [(move_item, move_tag,
+                                                     move_amount)]
+    while len(hist) > 0:
+        move_item, move_amount, _, move_tag = hist.pop()
+        added = False
+        for i in range(len(supp_item_amount)):
+            if supp_item_amount[i][2] < 1:
+                continue
+            if supp_item_amount[i][0] == move_item and\
+                    supp_item_amount[i][1] == move_tag:
+                supp_item_amount[i] = (move_item, move_tag, move_amount +
+                                       supp_item_amount[i][2])
+                added = True
+        if not added:
+            supp_item_amount.append((move_item, move_tag, move_amount))
+
+    supp_item_amount.sort()
+
+    max_item, max_tag, max_amount = supp_item_amount[0]
+    for item, tag, amount in supp_item_amount[1:]:
+        if max_item == item:
+            if max_amount < amount:
+                max_tag = tag
+            if max_amount == amount:
+                suppliers.add(tag)
+        else:
+            suppliers.add(max_tag)
+            max_item = item
+            max_amount = amount
+            max_tag = tag
+    suppliers.add(max_tag)
+    return suppliers
+
+
+def benchmark(sizes: List[int], items: int, tags: int, seed: int,
+              quadratic_limit: int) -> List[Dict[str, float]]:
+    rows: List[Dict[str, float]] = []
+    for size in sizes:
+        wh = random_warehouse(size, items, tags, Random(f"{seed}-{size}"))
+        row: Dict[str, float] = {"movements": len(wh.history)}
+
+        start = perf_counter()
+        suppliers = wh.best_suppliers()
+        row["linear"] = perf_counter() - start
+
+        row["quadratic"] = -1.0
+        if size <= quadratic_limit:
+            start = perf_counter()
+            old_suppliers = quadratic_best_suppliers(wh.movement_rows())
+            row["quadratic"] = perf_counter() - start
+            assert suppliers == old_suppliers
+        rows.append(row)
+    return rows
+
+
+def print_rows(rows: List[Dict[str, float]]) -> None:
+    print(f"{'movements':>9} {'linear':>10} {'quadratic':>10} "
+          f"{'speedup':>9}")
+    for row in rows:
+        quadratic = speedup = "skipped"
+        if row["quadratic"] >= 0:
+            quadratic = f"{row['quadratic']:10.4f}"
+            speedup = f"{row['quadratic'] / max(row['linear'], 1e-9):8.0f}x"
+        print(f"{row['movements']:9d} {row['linear']:10.6f} "
+              f"{quadratic:>10} {speedup:>9}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Time best_suppliers against the old quadratic scan.")
+    parser.add_argument("-s", "--sizes", nargs="+", type=int, default=SIZES,
+                        help="movements in the generated histories")
+    parser.add_argument("-i", "--items", type=int, default=ITEMS)
+    parser.add_argument("-g", "--tags", type=int, default=TAGS)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("-q", "--quadratic-limit", type=int,
+                        default=QUADRATIC_LIMIT,
+                        help="largest history to run the old scan on")
+    args = parser.parse_args()
+
+    print_rows(benchmark(args.sizes, args.items, args.tags, args.seed,
+                         args.quadratic_limit))
+
+
+if __name__ == '__main__':
+    main()
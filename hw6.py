@@ -1,4 +1,41 @@
-from typing import List, Tuple, Optional, Set
+from typing import Dict, Iterable, Iterator, List, Tuple, Optional, Set, \
+    Union
+from array import array
+from functools import lru_cache
+from heapq import heapify, heappop, heappush
+from mmap import mmap, ACCESS_READ
+from random import Random
+from struct import Struct
+from time import perf_counter
+from itertools import permutations
+
+DIGITS = 0b1111111110
+BIT_COUNT = [bin(i).count("1") for i in range(1 << 10)]
+
+
+# maps (total, length) to the bitmasks of all sets of distinct digits
+# with that sum and size; there are only 512 such sets, so it is cheap
+# enough to build on import
+def build_combinations() -> Dict[Tuple[int, int], List[int]]:
+    table: Dict[Tuple[int, int], List[int]] = {}
+    for mask in range(0, DIGITS + 1, 2):
+        digits = [digit for digit in range(1, 10) if mask >> digit & 1]
+        table.setdefault((sum(digits), len(digits)), []).append(mask)
+    return table
+
+
+COMBINATIONS = build_combinations()
+
+# steps a random_board fill may take before it gives up on the layout;
+# almost every fill needs about one step per cell
+FILL_LIMIT = 10000
+
+# binary container: MAGIC and a puzzle count, then for every puzzle its
+# BOARD header, width * height signed bytes of cells and its CLUE records
+MAGIC = b"KAKURO\x00\x01"
+HEADER = Struct("<8sI")
+BOARD = Struct("<HHH")
+CLUE = Struct("<HHBBH")
 
 
 class Clue:
@@ -10,15 +47,120 @@ class Clue:
         self.length = length
 
 
+# counters filled in by the solvers when Kakuro.stats is set; with stats
+# left as None the solvers skip all of the bookkeeping
+class SolverStats:
+    def __init__(self) -> None:
+        self.nodes = 0
+        self.backtracks = 0
+        self.candidates = 0
+        self.max_depth = 0
+        self.valid_time = 0.0
+        self.finished_time = 0.0
+
+    def as_dict(self) -> Dict[str, float]:
+        return dict(vars(self))
+
+
 class Kakuro:
     def __init__(self, width: int, height: int):
         self.width = width
         self.height = height
         self.array = [[-1 for _ in range(width)] for _ in range(height)]
         self.clues: List[Clue] = []
+        self.stats: Optional[SolverStats] = None
+        self.weights: List[int] = []
+        self.init_state()
+
+    # running per-clue state (sum, used digits, empty cells), kept up to
+    # date by set(); it is rebuilt whenever array or clues is replaced
+    def init_state(self) -> None:
+        self.state_array = self.array
+        self.state_clues = self.clues
+        self.cell_clues: List[List[List[int]]] = \
+            [[[] for _ in row] for row in self.array]
+        count = len(self.clues)
+        self.clue_sum = [0 for _ in range(count)]
+        self.clue_used = [0 for _ in range(count)]
+        self.clue_empty = [0 for _ in range(count)]
+        self.clue_dups = [0 for _ in range(count)]
+        self.clue_counts = [[0 for _ in range(10)] for _ in range(count)]
+        self.broken = 0
+        self.unfinished = 0
+
+        for index, clue in enumerate(self.clues):
+            for x, y in self.clue_cells(clue):
+                self.cell_clues[y][x].append(index)
+                self.add_num(index, self.array[y][x])
+            if self.is_broken(index):
+                self.broken += 1
+            if not self.is_done(index):
+                self.unfinished += 1
+        self.build_clue_heap()
+
+    # set() only ever pushes, and a clue that gets back to an earlier count
+    # makes its old entry current again, so the heap is rebuilt from the
+    # counts once it outgrows the clues a few times over
+    def build_clue_heap(self) -> None:
+        self.clue_heap = [(empty, index)
+                          for index, empty in enumerate(self.clue_empty)
+                          if empty > 0]
+        heapify(self.clue_heap)
+
+    def ensure_state(self) -> None:
+        if self.array is not self.state_array \
+                or self.clues is not self.state_clues:
+            self.init_state()
+
+    def is_broken(self, index: int) -> bool:
+        return self.clue_sum[index] > self.clues[index].total \
+            or self.clue_dups[index] > 0
+
+    def is_done(self, index: int) -> bool:
+        return self.clue_empty[index] == 0 and self.clue_dups[index] == 0 \
+            and self.clue_sum[index] == self.clues[index].total
+
+    def add_num(self, index: int, num: int) -> None:
+        if num <= 0:
+            self.clue_empty[index] += 1
+            return
+        counts = self.clue_counts[index]
+        counts[num] += 1
+        if counts[num] == 1:
+            self.clue_used[index] |= 1 << num
+        elif counts[num] == 2:
+            self.clue_dups[index] += 1
+        self.clue_sum[index] += num
+
+    def remove_num(self, index: int, num: int) -> None:
+        if num <= 0:
+            self.clue_empty[index] -= 1
+            return
+        counts = self.clue_counts[index]
+        counts[num] -= 1
+        if counts[num] == 0:
+            self.clue_used[index] &= ~(1 << num)
+        elif counts[num] == 1:
+            self.clue_dups[index] -= 1
+        self.clue_sum[index] -= num
 
     def set(self, x: int, y: int, value: int) -> None:
+        self.ensure_state()
+        old = self.array[y][x]
         self.array[y][x] = value
+        if old == value:
+            return
+        for index in self.cell_clues[y][x]:
+            broken = self.is_broken(index)
+            done = self.is_done(index)
+            self.remove_num(index, old)
+            self.add_num(index, value)
+            self.broken += self.is_broken(index) - broken
+            self.unfinished += done - self.is_done(index)
+            if (old <= 0) != (value <= 0) and self.clue_empty[index] > 0:
+                heappush(self.clue_heap, (self.clue_empty[index], index))
+        if len(self.clue_heap) > 4 * len(self.clues) + 16:
+            self.build_clue_heap()
 
     def show_board(self) -> None:
         for row in self.array:
@@ -32,7 +174,11 @@ class Kakuro:
                     line = " ".join([line, str(field)])
             print(line[1:])
 
-    def save(self, filename: str) -> None:
+    def save(self, filename: str, binary: bool = False) -> None:
+        if binary:
+            save_kakuros(filename, [self])
+            return
+
         result: List[List[str]] = []
         for row in self.array:
             line: List[str] = []
@@ -60,82 +206,31 @@ class Kakuro:
                 file.write(line_out[1:] + '\n')
 
     def is_valid(self) -> bool:
-        for clue in self.clues:
-            used_nums: Set[int] = set()
-            if clue.is_row:
-                direction = (1, 0)
-            else:
-                direction = (0, 1)
-            x = clue.position[0] + direction[0]
-            y = clue.position[1] + direction[1]
-            total = 0
-            move = clue.length
-
-            while move > 0:
-                num = self.array[y][x]
-                total += num
-                if total > clue.total or (num != 0 and num in used_nums):
-                    return False
-                used_nums.add(num)
-                x += direction[0]
-                y += direction[1]
-                move -= 1
-        return True
+        self.ensure_state()
+        return self.broken == 0
 
+    # the clue with the fewest (but some) empty cells, earliest on ties;
+    # heap entries whose count is out of date are dropped on the way
     def pick_clue(self) -> Optional[Clue]:
-        min_count: Tuple[int, int] = (0, 0)
-        for clue in self.clues:
-            count = 0
-            if clue.is_row:
-                direction = (1, 0)
-            else:
-                direction = (0, 1)
-
-            x = clue.position[0] + direction[0]
-            y = clue.position[1] + direction[1]
-            for _ in range(clue.length):
-                if self.array[y][x] == 0:
-                    count += 1
-                x += direction[0]
-                y += direction[1]
-
-            if min_count[0] == 0:
-                min_count = (count, self.clues.index(clue))
-            elif count != 0 and count < min_count[0]:
-                min_count = (count, self.clues.index(clue))
-
-        if min_count[0] == 0:
-            return None
-        return self.clues[min_count[1]]
+        self.ensure_state()
+        heap = self.clue_heap
+        while heap:
+            empty, index = heap[0]
+            if empty != 0 and empty == self.clue_empty[index]:
+                return self.clues[index]
+            heappop(heap)
+        return None
 
     def is_finished(self) -> bool:
-        for clue in self.clues:
-            used_nums: Set[int] = set()
+        self.ensure_state()
+        return self.unfinished == 0
 
-            if clue.is_row:
-                direction = (1, 0)
-            else:
-                direction = (0, 1)
-            x = clue.position[0] + direction[0]
-            y = clue.position[1] + direction[1]
-            total = 0
-            move = clue.length
+    def solve(self, depth: int = 0) -> bool:
+        stats = self.stats
+        if stats is not None:
+            stats.nodes += 1
+            stats.max_depth = max(stats.max_depth, depth)
 
-            while move > 0:
-                num = self.array[y][x]
-                total += num
-                if num == 0 or num in used_nums:
-                    return False
-                used_nums.add(num)
-                x += direction[0]
-                y += direction[1]
-                move -= 1
-
-            if total != clue.total:
-                return False
-        return True
-
-    def solve(self) -> bool:
         clue = self.pick_clue()
         if clue:
             partial: List[int] = []
@@ -151,6 +246,8 @@ class Kakuro:
                 x += direction[0]
                 y += direction[1]
             cells = cells_from_partial(clue.total, partial)
+            if stats is not None:
+                stats.candidates += len(cells)
 
             for cell in cells:
                 changed: List[Tuple[Tuple[int, int], int]] = []
@@ -159,52 +256,484 @@ class Kakuro:
 
                 for i in range(clue.length):
                     changed.append(((x, y), self.array[y][x]))
-                    self.array[y][x] = cell[i]
+                    self.set(x, y, cell[i])
                     x += direction[0]
                     y += direction[1]
 
-                if self.solve() and self.is_valid():
+                if stats is None:
+                    valid = self.is_valid()
+                else:
+                    start = perf_counter()
+                    valid = self.is_valid()
+                    stats.valid_time += perf_counter() - start
+                if valid and self.solve(depth + 1):
                     return True
 
-                for (x, y), val in changed:
-                    self.array[y][x] = val
+                if stats is not None:
+                    stats.backtracks += 1
+                for (x, y), val in changed[::-1]:
+                    self.set(x, y, val)
 
             return False
-        return self.is_finished()
+
+        if stats is None:
+            return self.is_finished()
+        start = perf_counter()
+        finished = self.is_finished()
+        stats.finished_time += perf_counter() - start
+        return finished
+
+    def clue_cells(self, clue: Clue) -> List[Tuple[int, int]]:
+        if clue.is_row:
+            direction = (1, 0)
+        else:
+            direction = (0, 1)
+        x = clue.position[0] + direction[0]
+        y = clue.position[1] + direction[1]
+        cells: List[Tuple[int, int]] = []
+        for _ in range(clue.length):
+            cells.append((x, y))
+            x += direction[0]
+            y += direction[1]
+        return cells
+
+    # searches over candidate bitmasks (bit d = digit d) of every cell,
+    # pruned through both crossing clues after each guess
+    def solve_propagate(self) -> bool:
+        cells, domains, clue_cells, cell_clues = self.search_setup()
+        queue = list(range(len(self.clues)))
+        if not self.propagate(domains, queue, clue_cells, cell_clues):
+            return False
+        solution = self.search(domains, clue_cells, cell_clues)
+        if solution is None:
+            return False
+        for (x, y), domain in zip(cells, solution):
+            self.set(x, y, domain.bit_length() - 1)
+        return True
+
+    # number of solutions, counting no further than limit; the board
+    # itself is left as it is
+    def count_solutions(self, limit: int = 2) -> int:
+        _, domains, clue_cells, cell_clues = self.search_setup()
+        queue = list(range(len(self.clues)))
+        if limit <= 0 or \
+                not self.propagate(domains, queue, clue_cells, cell_clues):
+            return 0
+        return self.count(domains, clue_cells, cell_clues, limit)
+
+    def search_setup(self) -> Tuple[List[Tuple[int, int]], List[int],
+                                    List[List[int]], List[List[int]]]:
+        cells: List[Tuple[int, int]] = []
+        cell_ids: Dict[Tuple[int, int], int] = {}
+        clue_cells: List[List[int]] = []
+        cell_clues: List[List[int]] = []
+
+        for index, clue in enumerate(self.clues):
+            ids: List[int] = []
+            for x, y in self.clue_cells(clue):
+                if (x, y) not in cell_ids:
+                    cell_ids[(x, y)] = len(cells)
+                    cells.append((x, y))
+                    cell_clues.append([])
+                ids.append(cell_ids[(x, y)])
+                cell_clues[cell_ids[(x, y)]].append(index)
+            clue_cells.append(ids)
+
+        domains: List[int] = []
+        for x, y in cells:
+            value = self.array[y][x]
+            domains.append(DIGITS if value == 0 else 1 << value)
+
+        self.weights = [1 for _ in self.clues]
+        return cells, domains, clue_cells, cell_clues
+
+    # the cell with the fewest candidates per failure seen so far in its
+    # clues, which steers the search towards the part of the board that
+    # keeps going wrong; -1 once every cell has a single candidate
+    def pick_cell(self, domains: List[int],
+                  cell_clues: List[List[int]]) -> int:
+        weights = self.weights
+        best = -1
+        best_score = 10.0
+        for i, domain in enumerate(domains):
+            count = BIT_COUNT[domain]
+            if count > 1:
+                score = count / sum(weights[c] for c in cell_clues[i])
+                if best == -1 or score < best_score:
+                    best, best_score = i, score
+        return best
+
+    def search(self, domains: List[int], clue_cells: List[List[int]],
+               cell_clues: List[List[int]],
+               depth: int = 0) -> Optional[List[int]]:
+        stats = self.stats
+        if stats is not None:
+            stats.nodes += 1
+            stats.max_depth = max(stats.max_depth, depth)
+
+        best = self.pick_cell(domains, cell_clues)
+        if best == -1:
+            return domains
+
+        domain = domains[best]
+        if stats is not None:
+            stats.candidates += BIT_COUNT[domain]
+        while domain:
+            bit = domain & -domain
+            domain ^= bit
+            attempt = domains.copy()
+            attempt[best] = bit
+            if self.propagate(attempt, cell_clues[best].copy(),
+                              clue_cells, cell_clues):
+                solution = self.search(attempt, clue_cells, cell_clues,
+                                       depth + 1)
+                if solution is not None:
+                    return solution
+            if stats is not None:
+                stats.backtracks += 1
+        return None
+
+    # like search, but goes on after a solution until limit of them are
+    # found
+    def count(self, domains: List[int], clue_cells: List[List[int]],
+              cell_clues: List[List[int]], limit: int,
+              depth: int = 0) -> int:
+        stats = self.stats
+        if stats is not None:
+            stats.nodes += 1
+            stats.max_depth = max(stats.max_depth, depth)
+
+        best = self.pick_cell(domains, cell_clues)
+        if best == -1:
+            return 1
+
+        found = 0
+        domain = domains[best]
+        if stats is not None:
+            stats.candidates += BIT_COUNT[domain]
+        while domain and found < limit:
+            bit = domain & -domain
+            domain ^= bit
+            attempt = domains.copy()
+            attempt[best] = bit
+            if self.propagate(attempt, cell_clues[best].copy(),
+                              clue_cells, cell_clues):
+                found += self.count(attempt, clue_cells, cell_clues,
+                                    limit - found, depth + 1)
+            elif stats is not None:
+                stats.backtracks += 1
+        return found
+
+    def propagate(self, domains: List[int], queue: List[int],
+                  clue_cells: List[List[int]],
+                  cell_clues: List[List[int]]) -> bool:
+        pending = set(queue)
+        while queue:
+            index = queue.pop()
+            pending.discard(index)
+            clue = self.clues[index]
+
+            fixed = 0
+            free: List[int] = []
+            for cell in clue_cells[index]:
+                domain = domains[cell]
+                if BIT_COUNT[domain] == 1:
+                    if domain & fixed:
+                        self.weights[index] += 1
+                        return False
+                    fixed |= domain
+                else:
+                    free.append(cell)
+
+            reachable = 0
+            for cell in free:
+                reachable |= domains[cell]
+
+            found = False
+            allowed = 0
+            required = DIGITS
+            for combo in allowed_combinations(clue.total, clue.length,
+                                              fixed | reachable):
+                if combo & fixed != fixed:
+                    continue
+                rest = combo & ~fixed
+                for cell in free:
+                    if not domains[cell] & rest:
+                        break
+                else:
+                    found = True
+                    allowed |= rest
+                    required &= rest
+            if not found:
+                self.weights[index] += 1
+                return False
+
+            changed: List[int] = []
+            for cell in free:
+                domain = domains[cell] & allowed
+                if domain == 0:
+                    self.weights[index] += 1
+                    return False
+                if domain != domains[cell]:
+                    domains[cell] = domain
+                    changed.append(cell)
+
+            # a digit that every remaining combination needs, but only one
+            # cell can still take, has to go into that cell
+            while required:
+                bit = required & -required
+                required ^= bit
+                holders = [cell for cell in free if domains[cell] & bit]
+                if len(holders) == 0:
+                    self.weights[index] += 1
+                    return False
+                if len(holders) == 1 and domains[holders[0]] != bit:
+                    domains[holders[0]] = bit
+                    changed.append(holders[0])
+
+            for cell in changed:
+                for other in cell_clues[cell]:
+                    if other not in pending:
+                        pending.add(other)
+                        queue.append(other)
+        return True
+
+
+def combination_masks(total: int, length: int) -> List[int]:
+    return COMBINATIONS.get((total, length), [])
+
+
+@lru_cache(maxsize=None)
+def allowed_combinations(total: int, length: int,
+                         allowed: int) -> Tuple[int, ...]:
+    return tuple(mask for mask in combination_masks(total, length)
+                 if mask & ~allowed == 0)
+
+
+@lru_cache(maxsize=None)
+def mask_permutations(mask: int) -> Tuple[Tuple[int, ...], ...]:
+    digits = [digit for digit in range(1, 10) if mask >> digit & 1]
+    return tuple(permutations(digits))
+
+
+def digits_mask(digits: Set[int]) -> int:
+    mask = 0
+    for digit in digits:
+        mask |= 1 << digit
+    return mask & DIGITS
 
 
 def load_kakuro(filename: str) -> Kakuro:
-    kakuro_array: List[List[int]] = []
-    clues: List['Clue'] = []
     with open(filename, "r") as file:
-        for line in file:
-            line_list = line.split()
-            kakuro_line = []
-
-            for field in line_list:
-                if field == ".":
-                    kakuro_line.append(0)
-                elif field.isnumeric():
-                    kakuro_line.append(int(field))
-                else:
-                    kakuro_line.append(-1)
-                    if field == "\\":
-                        continue
-                    field_clue = field.split('\\')
-                    col, row = field_clue[0], field_clue[1]
-                    x, y = len(kakuro_line) - 1, len(kakuro_array)
-                    if col != '':
-                        clues.append(Clue(int(col), (x, y), False, 0))
-                    if row != '':
-                        clues.append(Clue(int(row), (x, y), True, 0))
-            kakuro_array.append(kakuro_line)
-    clues = add_clues_length(clues, kakuro_array)
+        return parse_kakuro(file)
+
+
+# reads the board in one pass: clue lengths are counted while the cells
+# behind a clue are being read, so the grid is not walked a second time
+def parse_kakuro(lines: Iterable[str]) -> Kakuro:
+    kakuro_array: List[List[int]] = []
+    clues: List[Clue] = []
+    columns: Dict[int, Clue] = {}
+    kakuro_line: List[int] = []
+
+    for line in lines:
+        y = len(kakuro_array)
+        kakuro_line = []
+        row_clue: Optional[Clue] = None
+
+        for field in line.split():
+            x = len(kakuro_line)
+            if field == ".":
+                kakuro_line.append(0)
+            elif field.isnumeric():
+                kakuro_line.append(int(field))
+            else:
+                kakuro_line.append(-1)
+                row_clue = None
+                columns.pop(x, None)
+                if field == "\\":
+                    continue
+                field_clue = field.split('\\')
+                col, row = field_clue[0], field_clue[1]
+                if col != '':
+                    columns[x] = Clue(int(col), (x, y), False, 0)
+                    clues.append(columns[x])
+                if row != '':
+                    row_clue = Clue(int(row), (x, y), True, 0)
+                    clues.append(row_clue)
+                continue
+
+            if row_clue is not None:
+                row_clue.length += 1
+            if x in columns:
+                columns[x].length += 1
+
+        for x in [x for x in columns if x >= len(kakuro_line)]:
+            del columns[x]
+        kakuro_array.append(kakuro_line)
+
     kakuro = Kakuro(len(kakuro_line), len(kakuro_array))
     kakuro.array = kakuro_array
     kakuro.clues = sorted(clues, key=lambda x: x.position)
     return kakuro
 
 
+def kakuro_to_bytes(kakuro: Kakuro) -> bytes:
+    cells = array('b')
+    for row in kakuro.array:
+        cells.extend(row)
+    parts = [BOARD.pack(kakuro.width, kakuro.height, len(kakuro.clues)),
+             cells.tobytes()]
+    for clue in kakuro.clues:
+        x, y = clue.position
+        parts.append(CLUE.pack(x, y, clue.is_row, clue.total, clue.length))
+    return b"".join(parts)
+
+
+def kakuro_from_bytes(buffer: Union[bytes, mmap],
+                      offset: int = 0) -> Tuple[Kakuro, int]:
+    width, height, count = BOARD.unpack_from(buffer, offset)
+    offset += BOARD.size
+    cells = array('b', buffer[offset:offset + width * height]).tolist()
+    offset += width * height
+
+    kakuro = Kakuro(width, height)
+    kakuro.array = [cells[y * width:(y + 1) * width] for y in range(height)]
+    clues: List[Clue] = []
+    for _ in range(count):
+        x, y, is_row, total, length = CLUE.unpack_from(buffer, offset)
+        clues.append(Clue(total, (x, y), bool(is_row), length))
+        offset += CLUE.size
+    kakuro.clues = clues
+    return kakuro, offset
+
+
+def save_kakuros(filename: str, kakuros: Iterable[Kakuro]) -> int:
+    count = 0
+    with open(filename, "wb") as file:
+        file.write(HEADER.pack(MAGIC, 0))
+        for kakuro in kakuros:
+            file.write(kakuro_to_bytes(kakuro))
+            count += 1
+        file.seek(0)
+        file.write(HEADER.pack(MAGIC, count))
+    return count
+
+
+# lazily decodes the puzzles of a file written by save_kakuros; the file
+# is memory-mapped, so only the puzzles actually reached are read
+def iter_kakuros(filename: str) -> Iterator[Kakuro]:
+    with open(filename, "rb") as file:
+        with mmap(file.fileno(), 0, access=ACCESS_READ) as buffer:
+            magic, count = HEADER.unpack_from(buffer, 0)
+            if magic != MAGIC:
+                raise ValueError(f"{filename} is not a Kakuro container")
+            offset = HEADER.size
+            for _ in range(count):
+                kakuro, offset = kakuro_from_bytes(buffer, offset)
+                yield kakuro
+
+
+# a random board of width x height in which every white cell lies in a
+# row and a column run of 2 to 9 cells, filled with digits that do not
+# repeat within a run; density is the share of inner cells left white.
+# Some layouts take the fill a very long search (or have no fill at all),
+# so a fill that runs out of FILL_LIMIT steps starts over on a new layout
+def random_board(width: int, height: int, density: float,
+                 rng: Random) -> List[List[int]]:
+    while True:
+        board = random_layout(width, height, density, rng)
+        cells = [(x, y) for y in range(height) for x in range(width)
+                 if board[y][x] == 0]
+        if fill_board(board, cells, 0, rng, [FILL_LIMIT]):
+            return board
+
+
+def random_layout(width: int, height: int, density: float,
+                  rng: Random) -> List[List[int]]:
+    board = [[-1 for _ in range(width)] for _ in range(height)]
+    for y in range(1, height):
+        for x in range(1, width):
+            if rng.random() < density:
+                board[y][x] = 0
+
+    changed = True
+    while changed:
+        changed = False
+        for y in range(1, height):
+            for x in range(1, width):
+                if board[y][x] == -1:
+                    continue
+                row = run_cells(board, x, y, True)
+                column = run_cells(board, x, y, False)
+                if len(row) < 2 or len(column) < 2:
+                    board[y][x] = -1
+                    changed = True
+                elif len(row) > 9 or len(column) > 9:
+                    longer = row if len(row) > 9 else column
+                    cut_x, cut_y = longer[len(longer) // 2]
+                    board[cut_y][cut_x] = -1
+                    changed = True
+    return board
+
+
+def run_cells(board: List[List[int]], x: int, y: int,
+              is_row: bool) -> List[Tuple[int, int]]:
+    dx, dy = (1, 0) if is_row else (0, 1)
+    while board[y - dy][x - dx] != -1:
+        x, y = x - dx, y - dy
+    cells: List[Tuple[int, int]] = []
+    while y < len(board) and x < len(board[y]) and board[y][x] != -1:
+        cells.append((x, y))
+        x, y = x + dx, y + dy
+    return cells
+
+
+# fills cells[index:] by backtracking; budget[0] is the number of steps
+# left for the whole fill, and the fill fails once it runs out
+def fill_board(board: List[List[int]], cells: List[Tuple[int, int]],
+               index: int, rng: Random, budget: List[int]) -> bool:
+    if index == len(cells):
+        return True
+    if budget[0] == 0:
+        return False
+    budget[0] -= 1
+    x, y = cells[index]
+    used: Set[int] = set()
+    for is_row in True, False:
+        used.update(board[cy][cx] for cx, cy in run_cells(board, x, y, is_row))
+    digits = [digit for digit in range(1, 10) if digit not in used]
+    rng.shuffle(digits)
+    for digit in digits:
+        board[y][x] = digit
+        if fill_board(board, cells, index + 1, rng, budget):
+            return True
+    board[y][x] = 0
+    return False
+
+
+# the puzzle whose clues are the run sums of a filled board, with all of
+# its white cells left empty
+def kakuro_from_board(board: List[List[int]]) -> Kakuro:
+    height, width = len(board), len(board[0])
+    kakuro = Kakuro(width, height)
+    clues: List[Clue] = []
+    for x in range(width):
+        for y in range(height):
+            if board[y][x] != -1:
+                continue
+            for is_row in False, True:
+                dx, dy = (1, 0) if is_row else (0, 1)
+                if y + dy < height and x + dx < width \
+                        and board[y + dy][x + dx] != -1:
+                    run = run_cells(board, x + dx, y + dy, is_row)
+                    total = sum(board[cy][cx] for cx, cy in run)
+                    clues.append(Clue(total, (x, y), is_row, len(run)))
+    kakuro.array = [[min(field, 0) for field in row] for row in board]
+    kakuro.clues = clues
+    return kakuro
+
+
 def add_clues_length(clues: List['Clue'], kakuro: List[List[int]]
                      ) -> List['Clue']:
     for clue in clues:
@@ -231,92 +760,46 @@ def cells_from_empty(total: int, length: int) -> List[List[int]]:
     return cells_from_empty_with_unused(total, length, unused_nums)
 
 
-def cells_rec(total: int, length: int, unused_nums: Set[int],
-              attempt: List[int]) -> List[List[int]]:
-    result: List[List[int]] = []
-    length -= 1
-
-    if length == 1:
-        if total - 9 > 0:
-            return result
-        if total in unused_nums:
-            attempt[-length] = total
-            result.append(attempt.copy())
-        return result
-
-    for i in range(1, total):
-        if i not in unused_nums:
-            continue
-        if total - i < 0:
-            return result
-        unused_nums.remove(i)
-        attempt[-length] = i
-        result.extend(cells_rec(total - i, length, unused_nums,
-                                attempt.copy()))
-        attempt[-length] = 0
-        unused_nums.add(i)
-    return result
-
-
 def cells_from_empty_with_unused(total: int, length: int,
                                  unused_nums: Set[int]) -> List[List[int]]:
-    result: List[List[int]] = []
-    check = [i for i in range(9, 0, -1)]
-
-    if sum(check[:length]) < total:
+    if length <= 0:
         return []
-
-    if length == 1 and total < 10:
-        return [[total]]
-
-    at = [0 for _ in range(length)]
-
-    for i in range(1, 10):
-        if i not in unused_nums:
-            continue
-        unused_nums.remove(i)
-        at[0] = i
-        attempt = cells_rec(total - i, length, unused_nums, at)
-        unused_nums.add(i)
-        result.extend(attempt)
+    allowed = digits_mask(unused_nums)
+    result: List[List[int]] = []
+    for mask in allowed_combinations(total, length, allowed):
+        for digits in mask_permutations(mask):
+            result.append(list(digits))
+    result.sort()
     return result
 
 
 def cells_from_partial(total: int, partial: List[int]) -> List[List[int]]:
-    partial_hold: List[Tuple[int, int]] = []
-    unused_nums = {i for i in range(1, 10)}
-    partial_copy = partial.copy()
-    i = 0
-    if total < sum(partial_copy):
-        return []
-    length = len(partial_copy)
-
-    while i < length:
-        if partial_copy[i] != 0:
-            if partial_copy[i] not in unused_nums:
-                return []
-            partial_hold.append((i, partial_copy[i]))
-            unused_nums.remove(partial_copy[i])
-            total -= partial_copy[i]
-            partial_copy.pop(i)
-            length -= 1
-        else:
-            i += 1
+    used = 0
+    empty: List[int] = []
+    for i, num in enumerate(partial):
+        if num == 0:
+            empty.append(i)
+            continue
+        if not 0 < num < 10 or used >> num & 1:
+            return []
+        used |= 1 << num
+        total -= num
 
-    if total == 0:
-        if len(partial_hold) == len(partial):
+    if total < 0:
+        return []
+    if len(empty) == 0:
+        if total == 0:
             return [partial]
         return []
 
-    result = cells_from_empty_with_unused(total, length, unused_nums)
-    for i in range(len(result)):
-        for pos, val in partial_hold[::-1]:
-            result[i].insert(pos, val)
-
-    for attempt in result:
-        if len(attempt) != len(set(attempt)):
-            result.remove(attempt)
-
+    result: List[List[int]] = []
+    for mask in allowed_combinations(total, len(empty), DIGITS & ~used):
+        for digits in mask_permutations(mask):
+            attempt = partial.copy()
+            for pos, digit in zip(empty, digits):
+                attempt[pos] = digit
+            result.append(attempt)
+    result.sort()
     return result
 
 
@@ -472,6 +955,140 @@ def test_6() -> None:
     ]
 
 
+def test_7() -> None:
+    expected = example()
+    expected.solve()
+
+    kakuro = example()
+    assert kakuro.solve_propagate()
+    assert kakuro.array == expected.array
+    assert kakuro.is_finished()
+
+    kakuro = example()
+    kakuro.set(1, 1, 7)
+    assert not kakuro.solve_propagate()
+
+    assert combination_masks(4, 2) == [0b1010]
+    assert combination_masks(46, 9) == []
+    assert combination_masks(45, 9) == [DIGITS]
+
+
+def test_8() -> None:
+    assert cells_from_empty(6, 3) \
+        == [[1, 2, 3], [1, 3, 2], [2, 1, 3],
+            [2, 3, 1], [3, 1, 2], [3, 2, 1]]
+    assert cells_from_empty_with_unused(6, 2, {1, 2, 3, 4}) \
+        == [[2, 4], [4, 2]]
+    assert cells_from_empty(10, 1) == []
+
+    assert cells_from_partial(10, [0, 3, 0]) \
+        == [[1, 3, 6], [2, 3, 5], [5, 3, 2], [6, 3, 1]]
+    assert cells_from_partial(10, [4, 6]) == [[4, 6]]
+    assert cells_from_partial(10, [5, 5]) == []
+    assert cells_from_partial(3, [0, 4]) == []
+
+
+def test_9() -> None:
+    kakuro = example()
+    clue = kakuro.pick_clue()
+    assert clue is not None
+    row = kakuro.clues.index(clue)
+    assert kakuro.clue_empty[row] == 2
+
+    kakuro.set(1, 1, 9)
+    kakuro.set(2, 1, 9)
+    assert kakuro.clue_sum[row] == 18
+    assert kakuro.clue_used[row] == 1 << 9
+    assert kakuro.clue_empty[row] == 0
+    assert not kakuro.is_valid()
+
+    kakuro.set(2, 1, 7)
+    assert kakuro.is_valid()
+    assert kakuro.clue_used[row] == 1 << 9 | 1 << 7
+
+    kakuro.array = [line.copy() for line in kakuro.array]
+    kakuro.array[1][2] = 0
+    assert kakuro.is_valid()
+    assert kakuro.clue_empty[row] == 1
+
+    for _ in range(1000):
+        kakuro.set(1, 1, 0)
+        kakuro.set(1, 1, 9)
+    assert len(kakuro.clue_heap) <= 4 * len(kakuro.clues) + 16
+    assert kakuro.pick_clue() is kakuro.clues[row]
+
+
+def test_10() -> None:
+    kakuro = example()
+    kakuro.set(1, 1, 9)
+    kakuro.save(TEST_FILENAME, binary=True)
+    loaded = list(iter_kakuros(TEST_FILENAME))
+    assert len(loaded) == 1
+    assert loaded[0].array == kakuro.array
+    assert [(clue.total, clue.position, clue.is_row, clue.length)
+            for clue in loaded[0].clues] \
+        == [(clue.total, clue.position, clue.is_row, clue.length)
+            for clue in kakuro.clues]
+
+    assert save_kakuros(TEST_FILENAME, [kakuro, example()]) == 2
+    first, second = iter_kakuros(TEST_FILENAME)
+    assert first.array[1][1] == 9
+    assert second.solve_propagate()
+    assert second.is_finished()
+    write_example(TEST_FILENAME)
+
+
+def test_11() -> None:
+    kakuro = example()
+    kakuro.stats = SolverStats()
+    assert kakuro.solve()
+    assert kakuro.stats.nodes > 1
+    assert kakuro.stats.candidates >= kakuro.stats.backtracks
+    assert 0 < kakuro.stats.max_depth < kakuro.stats.nodes
+
+    kakuro = example()
+    kakuro.stats = SolverStats()
+    assert kakuro.solve_propagate()
+    assert kakuro.stats.nodes >= 1
+
+    board = random_board(9, 9, 0.8, Random(1))
+    kakuro = kakuro_from_board(board)
+    for clue in kakuro.clues:
+        assert 2 <= clue.length <= 9
+    assert kakuro.solve_propagate()
+    assert kakuro.is_finished()
+
+    # this layout once kept the fill searching for minutes
+    board = random_board(12, 12, 0.9, Random(211))
+    assert all(field != 0 for row in board for field in row)
+    assert not fill_board([[-1, -1, -1], [-1, 0, 0], [-1, 0, 0]],
+                          [(1, 1), (2, 1), (1, 2), (2, 2)], 0, Random(1),
+                          [2])
+
+
+def test_12() -> None:
+    kakuro = example()
+    assert kakuro.count_solutions() == 1
+    assert kakuro.count_solutions(limit=5) == 1
+    assert kakuro.count_solutions(limit=0) == 0
+    assert kakuro.array == example().array
+
+    kakuro.set(1, 1, 7)
+    assert kakuro.count_solutions() == 0
+
+    # 1 2 / 2 1 and 2 1 / 1 2 both fit
+    kakuro = parse_kakuro(["\\ 3\\ 3\\", "\\3 . .", "\\3 . ."])
+    assert kakuro.count_solutions() == 2
+    assert kakuro.count_solutions(limit=1) == 1
+    assert kakuro.count_solutions(limit=10) == 2
+
+    kakuro = parse_kakuro(["\\ 3\\ 4\\", "\\3 . .", "\\4 . ."])
+    assert [(clue.total, clue.position, clue.is_row, clue.length)
+            for clue in kakuro.clues] \
+        == [(3, (0, 1), True, 2), (4, (0, 2), True, 2),
+            (3, (1, 0), False, 2), (4, (2, 0), False, 2)]
+
+
 if __name__ == '__main__':
     test_1()
     # uncomment to visually check the results:
@@ -480,3 +1097,9 @@ if __name__ == '__main__':
     test_4()
     test_5()
     test_6()
+    test_7()
+    test_8()
+    test_9()
+    test_10()
+    test_11()
+    test_12()
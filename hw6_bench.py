@@ -0,0 +1,143 @@
+import argparse
+import json
+import signal
+from random import Random
+from time import perf_counter
+from typing import Any, Dict, Iterator, List, Tuple
+
+# change hw6 below if your file name is different
+from hw6 import SolverStats, kakuro_from_board, random_board
+from hw6_batch import SolveTimeout, raise_timeout
+
+SIZES = [6, 8, 10, 12, 15]
+DENSITIES = [0.6, 0.75, 0.9]
+BOARDS = 5
+SEED = 111
+TIMEOUT = 30.0
+METHODS = ["propagate"]
+
+Board = List[List[int]]
+Row = Dict[str, Any]
+
+
+# the same seed always gives the same boards, so runs of different
+# versions of the solver can be compared board by board
+def corpus(sizes: List[int], densities: List[float], boards: int,
+           seed: int) -> Iterator[Tuple[int, float, int, Board]]:
+    for size in sizes:
+        for density in densities:
+            rng = Random(f"{seed}-{size}-{density}")
+            for index in range(boards):
+                yield size, density, index, \
+                    random_board(size, size, density, rng)
+
+
+def run(method: str, board: Board, timeout: float) -> Row:
+    kakuro = kakuro_from_board(board)
+    stats = SolverStats()
+    kakuro.stats = stats
+    status = "unsolved"
+    timer = timeout > 0 and hasattr(signal, "setitimer")
+
+    if timer:
+        signal.signal(signal.SIGALRM, raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    start = perf_counter()
+    try:
+        try:
+            if method == "solve":
+                solved = kakuro.solve()
+            else:
+                solved = kakuro.solve_propagate()
+            if solved:
+                status = "solved"
+        finally:
+            if timer:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+    except SolveTimeout:
+        status = "timeout"
+
+    row: Row = {"method": method, "status": status,
+                "time": perf_counter() - start}
+    row.update(stats.as_dict())
+    return row
+
+
+def benchmark(methods: List[str], sizes: List[int], densities: List[float],
+              boards: int, seed: int, timeout: float) -> List[Row]:
+    rows: List[Row] = []
+    for size, density, index, board in corpus(sizes, densities, boards,
+                                              seed):
+        for method in methods:
+            row = run(method, board, timeout)
+            row.update({"size": size, "density": density, "board": index})
+            rows.append(row)
+    return rows
+
+
+def summarize(rows: List[Row]) -> Dict[str, Row]:
+    groups: Dict[str, Row] = {}
+    for row in rows:
+        key = f"{row['method']} {row['size']}x{row['size']} " \
+              f"{row['density']:.2f}"
+        group = groups.setdefault(key, {"boards": 0, "timeouts": 0,
+                                        "time": 0.0, "nodes": 0,
+                                        "backtracks": 0, "max_depth": 0})
+        group["boards"] += 1
+        group["timeouts"] += row["status"] == "timeout"
+        group["time"] += row["time"]
+        group["nodes"] += row["nodes"]
+        group["backtracks"] += row["backtracks"]
+        group["max_depth"] = max(group["max_depth"], row["max_depth"])
+    return groups
+
+
+def print_summary(groups: Dict[str, Row],
+                  baseline: Dict[str, Row]) -> None:
+    print(f"{'group':<24} {'time':>9} {'nodes':>9} {'backtr.':>9} "
+          f"{'depth':>5} {'t/o':>3} {'vs base':>8}")
+    for key, group in groups.items():
+        ratio = ""
+        if key in baseline and baseline[key]["time"] > 0:
+            ratio = f"{group['time'] / baseline[key]['time']:7.2f}x"
+        print(f"{key:<24} {group['time']:9.3f} {group['nodes']:9d} "
+              f"{group['backtracks']:9d} {group['max_depth']:5d} "
+              f"{group['timeouts']:3d} {ratio:>8}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Time the Kakuro solvers on a generated corpus.")
+    parser.add_argument("-m", "--methods", nargs="+", default=METHODS,
+                        choices=["solve", "propagate"])
+    parser.add_argument("-s", "--sizes", nargs="+", type=int, default=SIZES)
+    parser.add_argument("-d", "--densities", nargs="+", type=float,
+                        default=DENSITIES)
+    parser.add_argument("-n", "--boards", type=int, default=BOARDS,
+                        help="boards per size and density")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("-t", "--timeout", type=float, default=TIMEOUT,
+                        help="seconds per board, 0 for no limit")
+    parser.add_argument("-o", "--output",
+                        help="JSON file to store the results in")
+    parser.add_argument("-c", "--compare",
+                        help="JSON file of an earlier run to compare with")
+    args = parser.parse_args()
+
+    rows = benchmark(args.methods, args.sizes, args.densities, args.boards,
+                     args.seed, args.timeout)
+    groups = summarize(rows)
+
+    baseline: Dict[str, Row] = {}
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)["summary"]
+    print_summary(groups, baseline)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"rows": rows, "summary": groups}, file, indent=1)
+
+
+if __name__ == '__main__':
+    main()
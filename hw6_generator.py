@@ -0,0 +1,82 @@
+import argparse
+import os
+from multiprocessing import Pool
+from random import Random
+from typing import Iterator, Optional, Tuple
+
+# change hw6 below if your file name is different
+from hw6 import Kakuro, kakuro_from_board, kakuro_from_bytes, \
+    kakuro_to_bytes, random_board, save_kakuros
+
+SIZE = 12
+DENSITY = 0.75
+SEED = 111
+
+
+# a puzzle with exactly one solution: the clues of a random filled board,
+# plus those of its digits that cannot be removed without letting another
+# solution in; starting from the full board keeps every uniqueness check
+# cheap, where checking the bare clues first can take a long search
+def generate(width: int, height: int, density: float,
+             rng: Random) -> Kakuro:
+    board = random_board(width, height, density, rng)
+    kakuro = kakuro_from_board(board)
+    kakuro.array = [row.copy() for row in board]
+
+    cells = [(x, y) for y in range(height) for x in range(width)
+             if board[y][x] > 0]
+    rng.shuffle(cells)
+    for x, y in cells:
+        kakuro.set(x, y, 0)
+        if kakuro.count_solutions() != 1:
+            kakuro.set(x, y, board[y][x])
+    return kakuro
+
+
+def generate_job(job: Tuple[int, int, float, int]) -> bytes:
+    width, height, density, seed = job
+    return kakuro_to_bytes(generate(width, height, density, Random(seed)))
+
+
+# puzzle number i always comes from seed + i, whatever the number of
+# processes; processes=None uses every core
+def generate_many(count: int, width: int, height: int, density: float,
+                  seed: int = SEED,
+                  processes: Optional[int] = None) -> Iterator[Kakuro]:
+    jobs = [(width, height, density, seed + i) for i in range(count)]
+    with Pool(processes) as pool:
+        for data in pool.imap(generate_job, jobs, chunksize=8):
+            yield kakuro_from_bytes(data)[0]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Generate uniquely solvable Kakuro puzzles.")
+    parser.add_argument("count", type=int)
+    parser.add_argument("output",
+                        help="container file, or a directory with --text")
+    parser.add_argument("-s", "--size", type=int, nargs=2,
+                        default=[SIZE, SIZE], metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("-d", "--density", type=float, default=DENSITY)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("-j", "--processes", type=int, default=None,
+                        help="worker processes (default: all cores)")
+    parser.add_argument("--text", action="store_true",
+                        help="write one text file per puzzle")
+    args = parser.parse_args()
+
+    width, height = args.size
+    kakuros = generate_many(args.count, width, height, args.density,
+                            args.seed, args.processes)
+    if not args.text:
+        save_kakuros(args.output, kakuros)
+        return
+
+    os.makedirs(args.output, exist_ok=True)
+    digits = len(str(args.count))
+    for i, kakuro in enumerate(kakuros):
+        kakuro.save(os.path.join(args.output, f"{i:0{digits}d}.txt"))
+
+
+if __name__ == '__main__':
+    main()